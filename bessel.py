@@ -7,17 +7,34 @@ Implementation of
 
 @author: sstucker
 """
-import random
+import os
+import sys
+import copy
+import json
+import functools
 from numba import jit
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.patches import Polygon
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 import numpy as np
 from scipy.special import j0 as J0
 from scipy.constants import pi as PI
 
-from PIL import Image
+# The modules in besselgui import each other by name, as the GUI is run from there. They are imported by name here
+# too, so that each is loaded once, with one GRID_CACHE and one default cache, wherever it is used from
+BESSELGUI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'besselgui')
+if BESSELGUI_DIR not in sys.path:
+    sys.path.append(BESSELGUI_DIR)
+
+import masks
+from bmp_phase_mask_to_zemax_dat import dat_filename, phase_mask_to_dat
+from mask_archive import MaskArchive
+from mask_cache import default_cache
+from mask_export import export_image
 
 font = {'family' : 'Arial',
         'weight' : 'normal',
@@ -25,21 +42,11 @@ font = {'family' : 'Arial',
         }
 matplotlib.rc('font', **font)
 
-def axicon_mask(dimensions: np.ndarray, period: int, alpha: float = 0) -> np.ndarray:
-    mask = np.zeros(dimensions).astype(np.uint16)
-    _axicon_mask(mask, period, alpha)
-    mask = ((mask / np.max(mask)) * 255).astype(np.uint16)
-    return mask
+FIELD_CHUNK_ELEMENTS = 2**20  # Max. number of (z, r) samples evaluated at once by BesselSource.generate_field
+VOLUME_SLAB_ELEMENTS = 2**22  # Max. number of (z, x, y) samples computed and written at once by generate_volume
 
-@jit
-def _axicon_mask(mask: np.ndarray, period: int, alpha: float):
-    holo_x: int = mask.shape[0] // 2
-    holo_y: int = mask.shape[1] // 2
-    b2 = np.cos(alpha)**2
-    for i, x in enumerate(np.linspace(-holo_x, holo_x, mask.shape[0]).astype(np.float32)):
-        for j, y in enumerate(np.linspace(-holo_y, holo_y, mask.shape[1]).astype(np.float32)):
-            mask[i, j] = period - int(np.sqrt(b2 * x**2 + y**2)) % period
-            # mask[i, j] = np.exp(np.sqrt(b2 * x**2 + y**2))
+def axicon_mask(dimensions: np.ndarray, period: int, alpha: float = 0) -> np.ndarray:
+    return masks.axicon_mask(tuple(dimensions), period, alpha=(alpha, 0))
 
 
 @jit
@@ -61,7 +68,42 @@ TODO PhaseMask and Axicon both produce BesselField. There is one function,
 visualize, which takes both of them and produces a figure.
 """
 
+def _full_width_half_max(profile: np.ndarray, spacing: float) -> float:
+    """Width of the peak of `profile` at half its maximum, interpolated between samples `spacing` apart."""
+    peak = int(np.argmax(profile))
+    half = profile[peak] / 2
+    below = np.nonzero(profile < half)[0]
+    left, right = below[below < peak], below[below > peak]
+    if len(left) == 0 or len(right) == 0:
+        return np.inf  # The peak does not fall to half its maximum within the simulation
+    i, j = left[-1], right[0]
+    # Linearly interpolate the crossings on both sides of the peak
+    x0 = i + (half - profile[i]) / (profile[i + 1] - profile[i])
+    x1 = j - 1 + (profile[j - 1] - half) / (profile[j - 1] - profile[j])
+    return float(x1 - x0) * spacing
+
+
+def field_grid(field) -> tuple:
+    """Return the grid() of `field`, which must be a BesselField."""
+    if not isinstance(field, BesselField):
+        raise TypeError("Cannot interfere field with '{}'!".format(type(field).__name__))
+    return field.grid()
+
+
+def check_grids(grid: tuple, other: tuple):
+    """Raise ValueError unless the grid() tuples of two fields, or of a field and a FieldAccumulator, match."""
+    if not all([a == b for a, b in zip(grid, other)]):
+        raise ValueError('The fields are not equivalent')
+
+
 class BesselField():
+    """
+    Field on a (z, r) grid. Derived quantities are computed when first used and cached. Fields made with
+    from_intensity() only hold the float32 intensity, which is enough for everything but coherent sums.
+    """
+    
+    __slots__ = ('_field', '_intensity', '_axial_max_profile', '_fwhm', '_depth_of_focus',
+                 'wavelength', 'beam_waist', 'max_z', 'max_r')
     
     def __init__(self, field: np.ndarray, wavelength: float, beam_waist: float, simulation_length_z: float, simulation_radius_r: float):
         self._field = field
@@ -69,45 +111,309 @@ class BesselField():
         self.beam_waist = beam_waist
         self.max_z = simulation_length_z
         self.max_r = simulation_radius_r
-        
-        self.axial_max_profile = np.max(2 * np.abs(field)**2, axis=-1)  # Maximum intensity profile
-        self.axial_max_index = np.argmax(self.axial_max_profile)
-        self.axial_max = (self.axial_max_index / self._field.shape[0]) * simulation_length_z  # mm
+        self._intensity = None
+        self._axial_max_profile = None
+        self._fwhm = None
+        self._depth_of_focus = None
+    
+    @classmethod
+    def from_intensity(cls, intensity: np.ndarray, wavelength: float, beam_waist: float, simulation_length_z: float, simulation_radius_r: float):
+        """Return a field which only stores `intensity`, |field|^2, as float32."""
+        field = cls(None, wavelength, beam_waist, simulation_length_z, simulation_radius_r)
+        field._intensity = np.asarray(intensity, dtype=np.float32)
+        return field
     
     @property
     def field(self):
+        if self._field is None:
+            raise ValueError('Only the intensity of this field was kept')
         return self._field
     
+    @property
+    def has_phase(self) -> bool:
+        return self._field is not None
+    
     def shape(self):
-        return self._field.shape
-
+        return self._intensity.shape if self._field is None else self._field.shape
+    
+    @property
+    def intensity(self) -> np.ndarray:
+        """|field|^2, float32 for complex64 fields."""
+        if self._intensity is None:
+            self._intensity = np.square(self._field.real)
+            self._intensity += np.square(self._field.imag)
+        return self._intensity
+    
+    @property
+    def axial_max_profile(self) -> np.ndarray:
+        """Maximum intensity profile along z."""
+        if self._axial_max_profile is None:
+            self._axial_max_profile = 2 * np.max(self.intensity, axis=-1)
+        return self._axial_max_profile
+    
+    @property
+    def axial_max_index(self) -> int:
+        return int(np.argmax(self.axial_max_profile))
+    
+    @property
+    def axial_max(self) -> float:
+        """z of the maximum intensity (mm)."""
+        return (self.axial_max_index / self.shape()[0]) * self.max_z
+    
+    @property
+    def peak_intensity(self) -> float:
+        return float(self.axial_max_profile[self.axial_max_index])
+    
+    @property
+    def fwhm(self) -> float:
+        """Transverse full width at half maximum of the intensity at axial_max (mm)."""
+        if self._fwhm is None:
+            spacing = 2 * self.max_r / (self.shape()[1] - 1)
+            self._fwhm = _full_width_half_max(self.intensity[self.axial_max_index], spacing)
+        return self._fwhm
+    
+    @property
+    def depth_of_focus(self) -> float:
+        """Full width at half maximum of the maximum intensity profile along z (mm)."""
+        if self._depth_of_focus is None:
+            self._depth_of_focus = _full_width_half_max(self.axial_max_profile, self.max_z / (self.shape()[0] - 1))
+        return self._depth_of_focus
+    
+    def grid(self) -> tuple:
+        """The shape and parameters which must match for fields to be summed."""
+        return (tuple(self.shape()), self.wavelength, self.beam_waist, self.max_z, self.max_r)
+    
+    def check_equivalent(self, field):
+        check_grids(self.grid(), field_grid(field))
+    
+    def _invalidate(self):
+        self._intensity = None
+        self._axial_max_profile = None
+        self._fwhm = None
+        self._depth_of_focus = None
+    
     def __add__(self, field):
-        if isinstance(field, BesselField):
-            if not any([a == b for a, b in zip(
-                    (self.field.shape, self.wavelength, self.beam_waist, self.max_z, self.max_r),
-                    (field.field.shape, field.wavelength, field.beam_waist, field.max_z, field.max_r)
-            )]):
-                raise ValueError('The fields are not equivalent')
-            return BesselField(self.field + field.field, self.wavelength, self.beam_waist, self.max_z, self.max_r)
-        else:
-            raise TypeError("Cannot interfere field with '{}'!".format(type(field).__name__))
+        self.check_equivalent(field)
+        return BesselField(self.field + field.field, self.wavelength, self.beam_waist, self.max_z, self.max_r)
+    
+    def __iadd__(self, field):
+        """Interfere `field` with this one in place, without allocating a new array."""
+        self.check_equivalent(field)
+        np.add(self.field, field.field, out=self._field)
+        self._invalidate()
+        return self
         
 
 class BesselSource():
     
-    def generate_field(self, wavelength, beam_waist, simulation_length_z, simulation_radius_r, nz=512, nr=128) -> BesselField:
-        
+    def generate_field(self, wavelength, beam_waist, simulation_length_z, simulation_radius_r, nz=512, nr=128, chunk_size=None,
+                       intensity_only=False) -> BesselField:
+        """
+        Return the field on `nz` z from 0 to `simulation_length_z` and 2 `nr` + 1 r within +/-`simulation_radius_r`.
+        With `intensity_only` only the float32 intensity is kept, in half the memory, when the phase is not needed.
+        """
         # ZX-cross-section generation
-        xs = np.empty([nz, 2 * nr + 1], dtype=np.complex64)
-        for i, z in enumerate(np.linspace(0, simulation_length_z, nz)):
-            for j, r in enumerate(np.linspace(-simulation_radius_r, simulation_radius_r, 2 * nr + 1)):
-                xs[i, j] = self.bessel(z, r, wavelength, beam_waist)
+        xs = np.empty([nz, 2 * nr + 1], dtype=np.float32 if intensity_only else np.complex64)
+        for rows, chunk in self.field_chunks(wavelength, beam_waist, simulation_length_z, simulation_radius_r, nz, nr, chunk_size):
+            xs[rows] = np.abs(chunk)**2 if intensity_only else chunk
+        if intensity_only:
+            return BesselField.from_intensity(xs, wavelength, beam_waist, simulation_length_z, simulation_radius_r)
         return BesselField(xs, wavelength, beam_waist, simulation_length_z, simulation_radius_r)
     
-    def bessel(self, z: float, r: float, wavelength: float, beam_waist: float) -> float:
+    def field_chunks(self, wavelength, beam_waist, simulation_length_z, simulation_radius_r, nz=512, nr=128, chunk_size=None):
+        """Yield (rows, field) for successive chunks of `chunk_size` z rows of the grid of generate_field()."""
+        zs = np.linspace(0, simulation_length_z, nz)
+        rs = np.linspace(-simulation_radius_r, simulation_radius_r, 2 * nr + 1)
+        # The whole (z, r) grid is evaluated in one broadcast call per chunk of z rows to bound memory
+        if chunk_size is None:
+            chunk_size = max(1, FIELD_CHUNK_ELEMENTS // rs.size)
+        for i in range(0, nz, chunk_size):
+            yield slice(i, i + chunk_size), self.bessel(zs[i:i + chunk_size, np.newaxis], rs[np.newaxis, :], wavelength, beam_waist)
+    
+    def volume_slabs(self, wavelength, beam_waist, zs, xs, ys, slab_size):
+        """
+        Yield (rows, field) for successive slabs of `slab_size` z of the field on the (z, x, y) grid of `zs`, `xs` and
+        `ys`. By default the field is taken as radially symmetric and evaluated with bessel() at each radius.
+        """
+        rs = np.hypot(xs[:, np.newaxis], ys[np.newaxis, :])
+        for i in range(0, len(zs), slab_size):
+            yield slice(i, i + slab_size), self.bessel(zs[i:i + slab_size, np.newaxis, np.newaxis], rs[np.newaxis], wavelength, beam_waist)
+    
+    def bessel(self, z, r, wavelength: float, beam_waist: float):
+        """Return the field at (z, r). z and r may be scalars or arrays that broadcast against each other."""
         raise NotImplementedError()
 
 
+class FieldAccumulator():
+    """
+    Sums any number of fields on the grid of generate_field() into one preallocated buffer, in place. Coherent sums
+    add the complex fields, so that they interfere. Incoherent sums add their intensities into a float32 buffer. Use
+    add_source() to sum a source's field chunk by chunk without allocating the field at all.
+    """
+    
+    def __init__(self, wavelength, beam_waist, simulation_length_z, simulation_radius_r, nz=512, nr=128, coherent=True):
+        self.wavelength = wavelength
+        self.beam_waist = beam_waist
+        self.max_z = simulation_length_z
+        self.max_r = simulation_radius_r
+        self.nz = nz
+        self.nr = nr
+        self.coherent = coherent
+        self.count = 0
+        self._buffer = np.zeros([nz, 2 * nr + 1], dtype=np.complex64 if coherent else np.float32)
+    
+    @classmethod
+    def like(cls, field: BesselField, coherent=True):
+        """Return an empty accumulator on the grid of `field`."""
+        nz, width = field.shape()
+        return cls(field.wavelength, field.beam_waist, field.max_z, field.max_r, nz, (width - 1) // 2, coherent)
+    
+    def grid(self) -> tuple:
+        return (self._buffer.shape, self.wavelength, self.beam_waist, self.max_z, self.max_r)
+    
+    def add(self, field: BesselField):
+        """Add `field`, which must be on the same grid. Coherent sums need fields with phase."""
+        check_grids(self.grid(), field_grid(field))
+        if self.coherent:
+            self._buffer += field.field
+        else:
+            self._buffer += field.intensity
+        self.count += 1
+        return self
+    
+    def __iadd__(self, field: BesselField):
+        return self.add(field)
+    
+    def add_source(self, source: BesselSource, chunk_size=None):
+        """Add the field of `source`, generated a chunk of z rows at a time into the buffer."""
+        for rows, chunk in source.field_chunks(self.wavelength, self.beam_waist, self.max_z, self.max_r, self.nz, self.nr, chunk_size):
+            if self.coherent:
+                self._buffer[rows] += chunk
+            else:
+                self._buffer[rows] += np.abs(chunk)**2
+        self.count += 1
+        return self
+    
+    def result(self) -> BesselField:
+        """
+        Return the sum as a BesselField, an intensity-only field if the sum is incoherent. The field shares the
+        accumulator's buffer, so call result() again after adding more fields.
+        """
+        if self.coherent:
+            return BesselField(self._buffer, self.wavelength, self.beam_waist, self.max_z, self.max_r)
+        return BesselField.from_intensity(self._buffer, self.wavelength, self.beam_waist, self.max_z, self.max_r)
+
+
+def volume_paths(path: str) -> (str, str):
+    """Return the paths of the .npy volume and its .json metadata for `path`, with or without the extension."""
+    base = os.path.splitext(path)[0] if path.lower().endswith('.npy') else path
+    return base + '.npy', base + '.json'
+
+
+def generate_volume(source: BesselSource, path: str, wavelength, beam_waist, simulation_length_z, simulation_radius_r,
+                    nz=1024, nx=512, ny=512, slab_size=None, intensity_only=False):
+    """
+    Compute the field of `source` on a grid of `nz` z from 0 to `simulation_length_z` and `nx` x `ny` points within
+    +/-`simulation_radius_r`, and write it to the .npy file `path` a slab of z at a time, so that the volume need not
+    fit in memory. Metadata is written to a .json file alongside. With `intensity_only`, the float32 intensity is
+    written instead of the complex64 field. Returns the volume as a BesselVolume.
+    """
+    npy_path, json_path = volume_paths(path)
+    zs = np.linspace(0, simulation_length_z, nz)
+    xs = np.linspace(-simulation_radius_r, simulation_radius_r, nx)
+    ys = np.linspace(-simulation_radius_r, simulation_radius_r, ny)
+    if slab_size is None:
+        slab_size = max(1, VOLUME_SLAB_ELEMENTS // (nx * ny))
+    metadata = {
+        'version': 1,
+        'source': type(source).__name__,
+        'source_params': source.archive_params() if isinstance(source, PhaseMask) else {},
+        'wavelength': wavelength,
+        'beam_waist': beam_waist,
+        'max_z': simulation_length_z,
+        'max_r': simulation_radius_r,
+        'shape': [nz, nx, ny],
+        'intensity_only': intensity_only,
+        'complete': False
+    }
+    with open(json_path, 'w') as file:
+        json.dump(metadata, file, indent=2)
+    volume = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float32 if intensity_only else np.complex64, shape=(nz, nx, ny))
+    for rows, slab in source.volume_slabs(wavelength, beam_waist, zs, xs, ys, slab_size):
+        volume[rows] = np.abs(slab)**2 if intensity_only else slab
+        volume.flush()  # Bound the memory held by written pages
+    del volume
+    metadata['complete'] = True  # Volumes interrupted while being written are not marked complete
+    with open(json_path, 'w') as file:
+        json.dump(metadata, file, indent=2)
+    return BesselVolume(npy_path)
+
+
+class BesselVolume():
+    """
+    A (z, x, y) field volume written by generate_volume(), memory-mapped with `mmap_mode` so that slabs are only read
+    from disk as they are used.
+    """
+    
+    def __init__(self, path: str, mmap_mode='r'):
+        self.path, json_path = volume_paths(path)
+        with open(json_path, 'r') as file:
+            self.metadata = json.load(file)
+        self.wavelength = self.metadata['wavelength']
+        self.beam_waist = self.metadata['beam_waist']
+        self.max_z = self.metadata['max_z']
+        self.max_r = self.metadata['max_r']
+        self.complete = self.metadata['complete']
+        self.data = np.load(self.path, mmap_mode=mmap_mode)
+    
+    def __len__(self):
+        return self.data.shape[0]
+    
+    def __getitem__(self, key) -> np.ndarray:
+        return self.data[key]
+    
+    def shape(self):
+        return self.data.shape
+    
+    @property
+    def has_phase(self) -> bool:
+        return not self.metadata['intensity_only']
+    
+    @property
+    def zs(self) -> np.ndarray:
+        return np.linspace(0, self.max_z, self.data.shape[0])
+    
+    @property
+    def xs(self) -> np.ndarray:
+        return np.linspace(-self.max_r, self.max_r, self.data.shape[1])
+    
+    @property
+    def ys(self) -> np.ndarray:
+        return np.linspace(-self.max_r, self.max_r, self.data.shape[2])
+    
+    def slab(self, start: int, stop: int) -> np.ndarray:
+        """Return z rows `start` to `stop` as a view of the memory map."""
+        return self.data[start:stop]
+    
+    def intensity(self, start: int, stop: int) -> np.ndarray:
+        """Return the intensity of z rows `start` to `stop`."""
+        slab = self.data[start:stop]
+        return np.abs(slab)**2 if self.has_phase else np.array(slab)
+    
+    def xy_section(self, z: float) -> np.ndarray:
+        """Return the intensity of the xy cross-section nearest `z` (mm)."""
+        i = int(np.argmin(np.abs(self.zs - z)))
+        return self.intensity(i, i + 1)[0]
+    
+    def zx_section(self, y: float = 0) -> BesselField:
+        """Return the zx cross-section nearest `y` (mm) as a BesselField, for FieldRenderer and the like."""
+        j = int(np.argmin(np.abs(self.ys - y)))
+        section = np.array(self.data[:, :, j])
+        if self.has_phase:
+            return BesselField(section, self.wavelength, self.beam_waist, self.max_z, self.max_r)
+        return BesselField.from_intensity(section, self.wavelength, self.beam_waist, self.max_z, self.max_r)
+
+
 class PhaseMask(BesselSource):
     
     def __init__(self, dimensions, pixel_size, phase_stroke, pixel_period, alpha=0):
@@ -120,13 +426,62 @@ class PhaseMask(BesselSource):
         self.phase_stroke = phase_stroke
         self.pixel_period = pixel_period
         self.alpha = alpha
-        self._mask = axicon_mask(dimensions, pixel_period, alpha=self.alpha)
+        cache = default_cache()
+        if cache is None:
+            self._mask = axicon_mask(dimensions, pixel_period, alpha=self.alpha)
+        else:
+            # Copy-on-write, so that the mask can be modified without changing the cache
+            self._mask = cache.get_or_create(
+                {'generator': 'PhaseMask', 'version': 1, 'dimensions': dimensions, 'period': pixel_period, 'alpha': alpha},
+                lambda: axicon_mask(dimensions, pixel_period, alpha=self.alpha),
+                mmap_mode='c'
+            )
+    
+    @classmethod
+    def from_archive(cls, archive, key, pixel_size=None, phase_stroke=None):
+        """
+        Return the PhaseMask in a MaskArchive, or the archive at that path, at index `key` or with the parameters in
+        the dict `key`. The mask itself is only read when first used. `pixel_size` and `phase_stroke` are used if
+        they were not archived with the mask.
+        """
+        if not isinstance(archive, MaskArchive):
+            archive = MaskArchive(archive)
+        index = key if isinstance(key, (int, np.integer)) else archive.find(**key)
+        params = archive.params(index)
+        phase_mask = cls.__new__(cls)
+        phase_mask.dimensions = archive.shape(index)
+        phase_mask.pixel_size = params.get('pixel_size', pixel_size)
+        phase_mask.phase_stroke = params.get('phase_stroke', phase_stroke)
+        phase_mask.pixel_period = params.get('period')
+        phase_mask.alpha = params.get('alpha', 0)
+        phase_mask._mask_array = None
+        phase_mask._mask_loader = functools.partial(archive.mask, index)
+        return phase_mask
+    
+    @property
+    def _mask(self):
+        if self._mask_array is None:
+            self._mask_array = self._mask_loader()
+        return self._mask_array
+    
+    @_mask.setter
+    def _mask(self, mask: np.ndarray):
+        self._mask_array = mask
+        self._mask_loader = None
         
     @property
     def mask(self):
         return self._mask    
     
-    def bessel(self, z: float, r: float, wavelength: float, beam_waist: float) -> float:
+    def archive_params(self) -> dict:
+        """Parameters which identify this mask in a MaskArchive."""
+        return {'period': self.pixel_period, 'alpha': self.alpha, 'pixel_size': self.pixel_size, 'phase_stroke': self.phase_stroke}
+    
+    def to_archive(self, archive: MaskArchive) -> int:
+        """Append the mask to `archive`, which must be open for writing, and return its index."""
+        return archive.append(self._mask, **self.archive_params())
+    
+    def bessel(self, z, r, wavelength: float, beam_waist: float):
         k = (2 * PI) / wavelength
         n = self.phase_stroke  # Index of refraction of SLM
         h = self.phase_stroke * wavelength  # Height of ramp
@@ -149,32 +504,49 @@ class PhaseMask(BesselSource):
     #     j0_term = J0((k*(n - 1)*h*r) / d)  # Pass in result of Bessel function. TODO implement bessel fn
     #     return _bessel_field(k, A, n, h, d, w, N, z, r, lam, j0_term)    
     
-    def add_using_uniform_random_sample(self, mask):
-        if not isinstance(mask, PhaseMask) or not self._mask.shape == mask._mask.shape:
-            raise ValueError("'mask' must be a PhaseMask instance with the same shape.")
-        mask1 = self._mask.copy()
-        mask2 = mask._mask
-        for i in random.sample(range(mask1.size), mask1.size // 2):
-            mask1.flat[i] = mask2.flat[i]
-        return mask1  # TODO make return a PhaseMask instance
-    
-    def add_using_radial_sections(self, mask, sections=128):
-        if not isinstance(mask, PhaseMask) or not self._mask.shape == mask._mask.shape:
-            raise ValueError("'mask' must be a PhaseMask instance with the same shape.")
-        mask1 = self._mask.copy()
-        mask2 = mask._mask
-        θs = np.linspace(0, 2 * np.pi, sections + 1)[:-1]
-        dθ = θs[1] - θs[0]
-        theta_bounds = []
-        for θ in θs[::2]:
-            theta_bounds.append((θ, θ + dθ))
-        for i, x in enumerate(np.arange(mask1.shape[0]) - mask1.shape[0] // 2):
-            for j, y in enumerate(np.arange(mask2.shape[1]) - mask2.shape[1] // 2):
-                θ = np.arctan2(-x, -y) + np.pi
-                for bounds in theta_bounds:
-                    if θ >= bounds[0] and θ < bounds[1]:
-                        mask1[i, j] = mask2[i, j]
-        return mask1  # TODO make return a PhaseMask instance
+    def _derived(self, mask: np.ndarray):
+        """Return a PhaseMask with the optical parameters of this one which wraps `mask`."""
+        derived = copy.copy(self)
+        derived._mask = mask
+        return derived
+    
+    def _others(self, mask) -> list:
+        others = [mask] if isinstance(mask, PhaseMask) else list(mask)
+        for other in others:
+            if not isinstance(other, PhaseMask) or not self._mask.shape == other._mask.shape:
+                raise ValueError("'mask' must be a PhaseMask instance or a sequence of PhaseMask instances with the same shape.")
+        return others
+    
+    def add_using_uniform_random_sample(self, mask, fraction=0.5, rng=None):
+        """
+        Return a PhaseMask in which a random `fraction` of the pixels are taken from `mask`, a PhaseMask or a sequence of
+        PhaseMasks. The fraction is split evenly between the masks unless a sequence of one fraction per mask is given.
+        `rng` is a numpy Generator or a seed for one.
+        """
+        others = self._others(mask)
+        fractions = np.broadcast_to(np.asarray(fraction, dtype=float) / (1 if np.ndim(fraction) else len(others)), (len(others),))
+        if np.any(fractions < 0) or np.sum(fractions) > 1:
+            raise ValueError('Mixing fractions must be non-negative and sum to at most 1, not {}'.format(fraction))
+        rng = np.random.default_rng(rng)
+        mixed = self._mask.copy()
+        counts = (fractions * mixed.size).astype(int)
+        # The unshuffled order of the sample is correlated with pixel index, so it is only split between masks shuffled
+        pixels = rng.choice(mixed.size, np.sum(counts), replace=False, shuffle=len(others) > 1)
+        flat = mixed.reshape(-1)
+        for other, sample in zip(others, np.split(pixels, np.cumsum(counts)[:-1])):
+            flat[sample] = other._mask.reshape(-1)[sample]
+        return self._derived(mixed)
+    
+    def add_using_radial_sections(self, mask, sections=128, weights=None):
+        """
+        Composite this mask with one PhaseMask or a sequence of PhaseMasks in alternating angular sections. The first
+        other mask fills the even sections. `weights` gives the number of consecutive sections taken from each of
+        (self, *masks) before the layout repeats.
+        """
+        others = self._others(mask)
+        if weights is not None:
+            weights = tuple(weights[1:]) + (weights[0],)
+        return self._derived(masks.composite_sectors([other._mask for other in others] + [self._mask], sections, weights=weights))
     
     def gridify(self, m, n):
         # Reject uneven divisions of the array. TODO allow arbitrary divisions
@@ -203,10 +575,51 @@ class PhaseMask(BesselSource):
         fig.set_facecolor('black')
         ax.imshow(np.rot90(self._mask), cmap='Greys_r')
     
-    def export(self, filename: str):
-        img = self._mask
-        bmp = Image.fromarray(np.rot90(img)).convert('RGB')
-        bmp.save(filename.split('.')[0] + '.bmp')
+    def export(self, filename: str, rgb: bool = False) -> str:
+        """
+        Export the mask as an 8-bit grayscale BMP, PNG or TIFF, by the extension of `filename`, or as a BMP if it has
+        none of these. With `rgb` the image is expanded to 24-bit RGB. Returns the path written.
+        """
+        return export_image(self._mask, filename, rgb)
+    
+    spectrum_harmonics = 4  # Harmonics of the mask's period kept by volume_slabs()
+    
+    def volume_slabs(self, wavelength, beam_waist, zs, xs, ys, slab_size):
+        """
+        Yield (rows, field) for slabs of the field on a (z, x, y) grid, propagated from the mask itself with the
+        angular spectrum method, so that ellipticity and composited masks are simulated. The mask is illuminated by a
+        Gaussian beam of 1/e radius `beam_waist` and delays the phase by 2 pi phase_stroke gray / 255. The spectrum is
+        cut off at `spectrum_harmonics` times the frequency of the period and evaluated directly at each (x, y), so the
+        grid may sample the beam more finely than the SLM's pixels. The field is only known up to a constant phase at
+        each z, and is in units of the illumination's peak amplitude rather than those of bessel().
+        """
+        width, height = self._mask.shape
+        # Coordinates of the first pixel of the mask, which is centered on the optical axis
+        x0, y0 = -(width - 1) / 2 * self.pixel_size, -(height - 1) / 2 * self.pixel_size
+        u = x0 + np.arange(width) * self.pixel_size
+        v = y0 + np.arange(height) * self.pixel_size
+        aperture = np.exp(-(u[:, np.newaxis]**2 + v[np.newaxis, :]**2) / beam_waist**2) * \
+            np.exp(1j * 2 * PI * self.phase_stroke * (self._mask / 255))
+        fx = np.fft.fftfreq(width, self.pixel_size)
+        fy = np.fft.fftfreq(height, self.pixel_size)
+        cutoff = self.spectrum_harmonics / (self.pixel_period * self.pixel_size)
+        kept_x, kept_y = np.abs(fx) <= cutoff, np.abs(fy) <= cutoff
+        spectrum = (np.fft.fft2(aperture)[kept_x][:, kept_y] / aperture.size).astype(np.complex64)
+        fx, fy = fx[kept_x], fy[kept_y]
+        # Inverse transform of the kept frequencies at the grid's coordinates relative to the first pixel
+        to_x = np.exp(2j * PI * (xs - x0)[:, np.newaxis] * fx[np.newaxis, :]).astype(np.complex64)
+        to_y = np.exp(2j * PI * fy[:, np.newaxis] * (ys - y0)[np.newaxis, :]).astype(np.complex64)
+        # Propagation phase per mm less that of the on-axis plane wave, k_z - k, in a form which does not cancel
+        f2 = fx[:, np.newaxis]**2 + fy[np.newaxis, :]**2
+        kz = -2 * PI * f2 / (np.sqrt(1 / wavelength**2 - f2) + 1 / wavelength)
+        for i in range(0, len(zs), slab_size):
+            z = zs[i:i + slab_size, np.newaxis, np.newaxis]
+            propagated = spectrum * np.exp(1j * kz * z).astype(np.complex64)
+            yield slice(i, i + slab_size), to_x @ propagated @ to_y
+
+    def export_dat(self, filename: str) -> str:
+        """Export the mask as a Zemax grid phase .dat file. Returns the path written."""
+        return phase_mask_to_dat(self, dat_filename(filename))
 
 
 class Axicon(BesselSource):
@@ -217,107 +630,173 @@ class Axicon(BesselSource):
         self.diameter = 2 * radius
         self.n = index_of_refraction
     
-    def bessel(self, z: float, r: float, wavelength: float, beam_waist: float):
-        """Return intensity of the bessel field at position (z, r) along the optical axis following the axicon. See [1] Equation 2."""
+    def bessel(self, z, r, wavelength: float, beam_waist: float):
+        """Return intensity of the bessel field at position (z, r) along the optical axis following the axicon. See [1] Equation 2.
+        z and r may be arrays, in which case they are broadcast against each other."""
         k = (2 * PI) / wavelength
         theta = self.angle  # Axicon base angle
         n = self.n  # Axicon index of refraction
         intensity = 1.0
         return 2*PI*k * np.tan(theta)**2 * (n - 1)**2 * z * intensity * np.exp(-2 * ((n - 1) * z * np.tan(theta) / beam_waist)**2) * J0(k * (n - 1) * r * np.tan(theta))**2
     
-    def get_equivalent_mask(self, dimensions, wavelength, pixel_size, phase_stroke) -> PhaseMask:
+    def get_equivalent_period(self, wavelength, pixel_size, phase_stroke) -> int:
+        """Return the PhaseMask pixel period equivalent to this axicon without generating the mask."""
         # Phase stroke of axicon equal to ([1] Equation 10.)
         axicon_h = wavelength / (self.n - 1)
         # Real phase stroke from SLM specs
         slm_h = wavelength * phase_stroke
         # Multiply by corrective phase stroke ratio
         px_per_ring = (slm_h / axicon_h) * (wavelength * phase_stroke) / (self.angle * pixel_size)
-        px_per_ring = round(px_per_ring)
-        return PhaseMask(dimensions, pixel_size, phase_stroke, px_per_ring)
+        return int(round(px_per_ring))
+    
+    def get_equivalent_mask(self, dimensions, wavelength, pixel_size, phase_stroke) -> PhaseMask:
+        return PhaseMask(dimensions, pixel_size, phase_stroke, self.get_equivalent_period(wavelength, pixel_size, phase_stroke))
     
 
-@staticmethod
-def visualize(field: BesselField, source: BesselSource, ray_alpha=0.15, number_of_rays=14, aspect=5):
-    fig, ax = plt.subplot_mosaic(
-        [['upper left', 'upper middle', 'upper right'], ['bottom', 'bottom', 'bottom']],
-        figsize=(17, 6),
-    )
-    fig.set_facecolor('black')
-    
-    # zx cross-section
-    ax['bottom'].imshow(np.rot90(np.abs(field.field)**2), cmap='Greys_r', extent=(0, field.max_z, -field.max_r, field.max_r))
-    ax['bottom'].set_facecolor('black')
-    ax['bottom'].set_xlabel('z (mm)', color='white')
-    ax['bottom'].tick_params(axis='x', colors='white')
-    ax['bottom'].set_xlabel('mm', color='white')
-    ax['bottom'].set_aspect(aspect)
-    
-    # Maximum intensity Z profile
-    ax['upper middle'].set_facecolor('black')
-    ax['upper middle'].plot(np.linspace(0, field.max_z, field.field.shape[0]), field.axial_max_profile, color='white', linewidth=1)
-    ax['upper middle'].tick_params(axis='x', colors='white')
-    ax['upper middle'].tick_params(axis='y', colors='white')
-    ax['upper middle'].set_xlabel('mm', color='white')
-    ax['upper middle'].set_ylabel('ADU', color='white')
-    ax['upper middle'].set_yticks([])
-    
-    
-    if isinstance(source, Axicon):
-
-        axicon_radius = source.diameter / 2
-        axicon_peak = axicon_radius * np.tan(source.angle)
-        axicon_thickness = axicon_peak * 10
-        
-        ax['bottom'].set_xlim(-axicon_thickness, field.max_z)
-        ax['bottom'].set_ylim(-axicon_radius, axicon_radius)
+def xy_section(field: BesselField, source: BesselSource, z=None, n=None) -> np.ndarray:
+    """
+    Return the intensity of the transverse cross-section at `z` (mm), by default where the intensity is greatest, on
+    an n x n grid spanning the field's radius, by default (2 (2 nr + 1) + 1) wide. The field is radially symmetric, so
+    it is evaluated once along a radius, sampled more finely than the grid, and interpolated onto the grid.
+    """
+    z = field.axial_max if z is None else z
+    n = 2 * field.shape()[1] + 1 if n is None else n
+    xs = np.linspace(-field.max_r, field.max_r, n)
+    rs = np.linspace(0, np.sqrt(2) * field.max_r, 4 * n)
+    profile = np.abs(source.bessel(z, rs, field.wavelength, field.beam_waist))**2
+    return np.interp(np.hypot(xs[:, np.newaxis], xs[np.newaxis, :]), rs, profile)
+
+
+class FieldRenderer():
+    """
+    Draws the figure of visualize(): the phase mask, the maximum intensity along z, the xy cross-section and the zx
+    cross-section with the rays and glass of an axicon. The figure and its artists are created once and updated in
+    place by each render(), so one renderer can draw any number of fields. Without a `figure`, the renderer draws on
+    a headless Agg canvas, independent of pyplot, for batch rendering with save().
+    """
+    
+    def __init__(self, figure=None, ray_alpha=0.15, number_of_rays=14, aspect=5):
+        if figure is None:
+            figure = Figure(figsize=(17, 6))
+            FigureCanvasAgg(figure)
+        self.figure = figure
+        self.ray_alpha = ray_alpha
+        self.number_of_rays = number_of_rays
+        self.aspect = aspect
+        self.figure.set_facecolor('black')
+        self.ax = self.figure.subplot_mosaic([['upper left', 'upper middle', 'upper right'], ['bottom', 'bottom', 'bottom']])
+        empty = np.zeros((2, 2))
         
-        # Rays
-        for r0 in np.linspace(0, field.beam_waist / 2, number_of_rays):
-            y1 = -axicon_peak + (axicon_radius - r0) * axicon_peak / axicon_radius
-            ax['bottom'].plot([-axicon_thickness, y1], [r0, r0], '-y', linewidth=0.5, alpha=ray_alpha)
-            ax['bottom'].plot([-axicon_thickness, y1], [-r0, -r0], '-y', linewidth=0.5, alpha=ray_alpha)
-            theta_i = source.angle
-            theta_o = np.arcsin(np.sin(theta_i) / source.n) - source.angle
-            y2 = r0 + field.max_z * np.tan(theta_o)
-            ax['bottom'].plot([y1, field.max_z], [r0, y2], '-y', linewidth=0.5, alpha=ray_alpha)
-            ax['bottom'].plot([y1, field.max_z], [-r0, -y2], '-y', linewidth=0.5, alpha=ray_alpha)
+        # zx cross-section
+        bottom = self.ax['bottom']
+        self._zx = bottom.imshow(empty, cmap='Greys_r')
+        bottom.set_facecolor('black')
+        bottom.tick_params(axis='x', colors='white')
+        bottom.set_xlabel('mm', color='white')
+        self._rays = LineCollection([], colors='y', linewidths=0.5, alpha=ray_alpha)
+        bottom.add_collection(self._rays)
+        self._glass = Polygon(np.zeros((5, 2)), fill=True, edgecolor=None, closed=True, facecolor='white', alpha=0.3)
+        bottom.add_patch(self._glass)
+        self._text = bottom.text(0, 0, '', color='white')
         
-        # Axicon glass
-        a = np.transpose(np.array([
-            [0, -axicon_peak, -axicon_thickness, -axicon_thickness, -axicon_peak],
-            [0, axicon_radius, axicon_radius, -axicon_radius, -axicon_radius]])
-        )
-        glass = Polygon(a, fill=True, edgecolor=None, closed=True, facecolor='white', alpha=0.3)
-        ax['bottom'].add_patch(glass)
+        # Maximum intensity Z profile
+        middle = self.ax['upper middle']
+        middle.set_facecolor('black')
+        self._profile, = middle.plot([], [], color='white', linewidth=1)
+        middle.tick_params(axis='x', colors='white')
+        middle.tick_params(axis='y', colors='white')
+        middle.set_xlabel('mm', color='white')
+        middle.set_ylabel('ADU', color='white')
+        middle.set_yticks([])
         
-        ax['upper left'].set_facecolor('black')
-
-        # Text
-        ax['bottom'].text(0, axicon_radius * 3.6, 'Axicon angle: {}°\nMaximum intensity at {} mm'.format(str(source.angle * 180 / PI)[0:6], str(field.axial_max)[0:6]), color='white')
+        # Phase mask
+        self.ax['upper left'].set_facecolor('black')
+        self._mask = self.ax['upper left'].imshow(empty, cmap='Greys_r', vmin=0, vmax=255)
         
-    elif isinstance(source, PhaseMask):
+        # xy cross-section
+        right = self.ax['upper right']
+        self._xy = right.imshow(empty, cmap='Greys_r')
+        right.tick_params(axis='x', colors='white')
+        right.tick_params(axis='y', colors='white')
+        right.set_xlabel('um', color='white')
+        right.set_ylabel('um', color='white')
+    
+    @staticmethod
+    def _set_image(image, data: np.ndarray, extent=None):
+        image.set_data(data)
+        image.set_clim(np.min(data), np.max(data))
+        if extent is not None:
+            image.set_extent(extent)
+    
+    def render(self, field: BesselField, source: BesselSource, z=None):
+        """Draw `field` generated by `source`, with the xy cross-section at `z`, by default the intensity maximum."""
+        bottom = self.ax['bottom']
+        self._set_image(self._zx, np.rot90(field.intensity), (0, field.max_z, -field.max_r, field.max_r))
+        bottom.set_aspect(self.aspect)
         
-        # Plot phase mask
-        ax['upper left'].imshow(np.rot90(source.mask), cmap='Greys_r')
+        self._profile.set_data(np.linspace(0, field.max_z, field.shape()[0]), field.axial_max_profile)
+        self.ax['upper middle'].relim()
+        self.ax['upper middle'].autoscale_view()
         
-        # Set beam profile limits
-        ax['bottom'].set_ylim(-field.max_r, field.max_r)
+        is_axicon = isinstance(source, Axicon)
+        self._rays.set_visible(is_axicon)
+        self._glass.set_visible(is_axicon)
+        self._mask.set_visible(isinstance(source, PhaseMask))
+        if is_axicon:
+            axicon_radius = source.diameter / 2
+            axicon_peak = axicon_radius * np.tan(source.angle)
+            axicon_thickness = axicon_peak * 10
+            bottom.set_xlim(-axicon_thickness, field.max_z)
+            bottom.set_ylim(-axicon_radius, axicon_radius)
+            
+            # Rays, above and below the axis, as one collection of segments
+            r0 = np.linspace(0, field.beam_waist / 2, self.number_of_rays)
+            y1 = -axicon_peak + (axicon_radius - r0) * axicon_peak / axicon_radius
+            theta_o = np.arcsin(np.sin(source.angle) / source.n) - source.angle
+            y2 = r0 + field.max_z * np.tan(theta_o)
+            segments = []
+            for sign in (1, -1):
+                segments.append(np.stack([np.stack([np.full_like(r0, -axicon_thickness), sign * r0], axis=-1),
+                                          np.stack([y1, sign * r0], axis=-1)], axis=1))
+                segments.append(np.stack([np.stack([y1, sign * r0], axis=-1),
+                                          np.stack([np.full_like(r0, field.max_z), sign * y2], axis=-1)], axis=1))
+            self._rays.set_segments(np.concatenate(segments))
+            
+            # Axicon glass
+            self._glass.set_xy(np.transpose(np.array([
+                [0, -axicon_peak, -axicon_thickness, -axicon_thickness, -axicon_peak],
+                [0, axicon_radius, axicon_radius, -axicon_radius, -axicon_radius]])
+            ))
+            
+            self._text.set_position((0, axicon_radius * 3.6))
+            self._text.set_text('Axicon angle: {}°\nMaximum intensity at {} mm'.format(str(source.angle * 180 / PI)[0:6], str(field.axial_max)[0:6]))
+        elif isinstance(source, PhaseMask):
+            mask = np.rot90(source.mask)
+            self._mask.set_data(mask)
+            self._mask.set_extent((-0.5, mask.shape[1] - 0.5, mask.shape[0] - 0.5, -0.5))
+            bottom.set_xlim(0, field.max_z)
+            bottom.set_ylim(-field.max_r, field.max_r)
+            self._text.set_position((0, field.max_r * 18))
+            self._text.set_text('SLM period: {} px ({} µm)\nMaximum intensity at {} mm'.format(str(source.pixel_period)[0:6], str(source.pixel_period * source.pixel_size * 1000)[0:6], str(field.axial_max)[0:6]))
+        else:
+            bottom.set_xlim(0, field.max_z)
+            bottom.set_ylim(-field.max_r, field.max_r)
+            self._text.set_text('')
         
-        # Text
-        ax['bottom'].text(0, field.max_r * 18, 'SLM period: {} px ({} µm)\nMaximum intensity at {} mm'.format(str(source.pixel_period)[0:6], str(source.pixel_period * source.pixel_size * 1000)[0:6], str(field.axial_max)[0:6]), color='white')
-    
-    # xy cross-section
-    z_disp = field.axial_max
-    xs_z = np.empty([2 * field.field.shape[1] + 1, 2 * field.field.shape[1] + 1], dtype=np.complex64)
-    for i, x in enumerate(np.linspace(-field.max_r, field.max_r, 2 * field.field.shape[1] + 1)):
-        for j, y in enumerate(np.linspace(-field.max_r, field.max_r, 2 * field.field.shape[1] + 1)):
-            r = np.linalg.norm([x, y])
-            xs_z[i, j] = source.bessel(z_disp, r, field.wavelength, field.beam_waist)
-    im = ax['upper right'].imshow(np.abs(xs_z)**2, cmap='Greys_r', extent=(-field.max_r * 1000, field.max_r * 1000, -field.max_r * 1000, field.max_r * 1000))
-    ax['upper right'].tick_params(axis='x', colors='white')
-    ax['upper right'].tick_params(axis='y', colors='white')
-    ax['upper right'].set_xlabel('um', color='white')
-    ax['upper right'].set_ylabel('um', color='white')
+        # xy cross-section
+        r_um = field.max_r * 1000
+        self._set_image(self._xy, xy_section(field, source, z), (-r_um, r_um, -r_um, r_um))
+        return self.figure
+    
+    def save(self, path: str, dpi=100):
+        self.figure.savefig(path, dpi=dpi, facecolor=self.figure.get_facecolor())
+
+
+def visualize(field: BesselField, source: BesselSource, ray_alpha=0.15, number_of_rays=14, aspect=5, z=None) -> FieldRenderer:
+    """Draw the field on a new pyplot figure. Use FieldRenderer directly to draw many fields."""
+    renderer = FieldRenderer(plt.figure(figsize=(17, 6)), ray_alpha, number_of_rays, aspect)
+    renderer.render(field, source, z)
+    return renderer
 
 
 # %% Demo
@@ -333,13 +812,15 @@ if __name__ == "__main__":
     SLM_PHASE_STROKE = 1.4  # TODO upload Meadowlark LUT
     SLM_PIXEL_SIZE = 9.2 * 10**-3  # mm
     
-    for angle_rad in np.linspace(0.003, 0.006, 24):
-        for angle_of_incidence in np.linspace(0, 24, 24):
-                ax = Axicon(angle_rad, AXICON_RADIUS, AXICON_INDEX)
-                mask = ax.get_equivalent_mask(SLM_DIM, WAVELENGTH, SLM_PIXEL_SIZE, SLM_PHASE_STROKE)
-                print('Creating mask with period', mask.pixel_period, 'corresponding to angle', str(angle_rad  * 1000)[0:4], 'mrad (' + str(angle_rad * 180 / PI)[0:4] + ' deg)')
-                mask = PhaseMask(SLM_DIM, SLM_PIXEL_SIZE, SLM_PHASE_STROKE, int(mask.pixel_period), alpha=angle_of_incidence * PI / 180)
-                mask.export('R:\\shohas01lab\\shohas01labspace\\Stephen\\bessel_masks_elliptic\\' + '1920_1152_N' + str(mask.pixel_period).zfill(3) + '_A' + str(angle_of_incidence)[0:4])
+    from sweep import axicon_sweep, run_sweep
+    
+    jobs = axicon_sweep(
+        'R:\\shohas01lab\\shohas01labspace\\Stephen\\bessel_masks_elliptic',
+        np.linspace(0.003, 0.006, 24),
+        np.linspace(0, 24, 24),
+        SLM_DIM, WAVELENGTH, SLM_PIXEL_SIZE, SLM_PHASE_STROKE, AXICON_RADIUS, AXICON_INDEX
+    )
+    run_sweep(jobs)
         
     # mask1 = PhaseMask(SLM_DIM, SLM_PIXEL_SIZE, SLM_PHASE_STROKE, 60)
     # for n in np.arange(1, 24):
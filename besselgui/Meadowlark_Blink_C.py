@@ -12,10 +12,17 @@ import ctypes
 
 class Blink():
     
-    def __init__(self, path_to_api: str):
+    def __init__(self, path_to_api: str, validate: bool = True):
+        """
+        If `validate` is True, the frame size passed to Write_image is checked against the SLM dimensions once, not on
+        every frame.
+        """
         self.connected = False
         self.api_loaded = False
-        self._lib = ctypes.cdll.LoadLibrary(path_to_api)
+        self.validate = validate
+        self._frame = None  # Persistent upload buffer, see frame()
+        self._validated_size = None  # Frame size which passed validation
+        self._lib = self._load_library(path_to_api)
         self._lib.Create_SDK.argtypes = [
             ctypes.c_uint32,
             ctypes.POINTER(ctypes.c_uint32),
@@ -32,7 +39,7 @@ class Blink():
         ]
         self._lib.Write_image.argtypes = [
                 ctypes.c_int,  # Board ID
-                np.ctypeslib.ndpointer(ctypes.c_uint8, flags="C_CONTIGUOUS"), # Image buffer
+                ctypes.c_void_p,  # Image buffer (uint8, in the order of mask.flatten(order='F'))
                 ctypes.c_uint32,  # Image size (width * height)
                 ctypes.c_int,  # Wait for trigger
                 ctypes.c_int,  # External pulse
@@ -44,6 +51,10 @@ class Blink():
         self._lib.Get_image_height.argtypes = [ctypes.c_int]
         self.api_loaded = True
         
+    def _load_library(self, path_to_api: str):
+        """Return the SDK library. Overridden by simulated backends, see mock_blink.MockBlink."""
+        return ctypes.cdll.LoadLibrary(path_to_api)
+        
     def Create_SDK(self, slm_bitness=12):
         if self.api_loaded:
             n_boards_found = ctypes.c_uint32()
@@ -75,16 +86,57 @@ class Blink():
                 return -1
         raise Exception('Library not successfully loaded')
         
-    def Write_image(self, phase_mask):
+    def frame(self, dimensions=None) -> np.ndarray:
+        """
+        Return the persistent upload buffer as a Fortran-ordered (width, height) uint8 view. Masks can be rendered into
+        it directly (i.e. with the kernels' `out` argument) and then uploaded with Write_image() without any copies.
+        The buffer is reallocated if `dimensions`, which default to those of the SLM, change.
+        """
+        if dimensions is None:
+            dimensions = self.Read_SLM_dimensions()
+        size = int(dimensions[0]) * int(dimensions[1])
+        if self._frame is None or self._frame.size != size:
+            self._frame = np.zeros(size, dtype=np.uint8)
+        return self._frame.reshape(dimensions, order='F')
+    
+    def _as_buffer(self, phase_mask) -> np.ndarray:
+        """Return the mask as the flat uint8 buffer the SLM expects, copying only if its layout or dtype requires it."""
+        if phase_mask is None:
+            if self._frame is None:
+                raise ValueError('No frame to write. Render into frame() or pass a phase mask')
+            return self._frame
+        if phase_mask.ndim > 1:
+            phase_mask = np.ravel(phase_mask, order='F')  # A view for Fortran-ordered masks such as frame()
+        if phase_mask.dtype != np.uint8 or not phase_mask.flags.c_contiguous:
+            phase_mask = np.ascontiguousarray(phase_mask, dtype=np.uint8)
+        return phase_mask
+    
+    def _validate(self, buffer: np.ndarray):
+        # _as_buffer guarantees a flat uint8 buffer, so only the size is left to check
+        width, height = self.Read_SLM_dimensions()
+        if width > -1 and height > -1 and buffer.size != width * height:
+            raise ValueError('Frame has {} pixels but the SLM has {} x {}'.format(buffer.size, width, height))
+        self._validated_size = buffer.size
+    
+    def Write_image(self, phase_mask=None, wait_for_trigger=False, external_pulse=False, timeout_ms=5000):
+        """
+        Upload a phase mask: either a (width, height) mask or a mask already flattened with order='F'. If `phase_mask`
+        is None, the buffer returned by frame() is uploaded. uint8 masks which are Fortran-ordered or already flat are
+        passed to the SDK without copying. With `wait_for_trigger`, the SLM waits up to `timeout_ms` for an external
+        trigger before loading the frame. With `external_pulse`, it outputs a pulse once the frame is loaded.
+        """
         if self.api_loaded:
+            buffer = self._as_buffer(phase_mask)
+            if self.validate and buffer.size != self._validated_size:
+                self._validate(buffer)
             try:
                 return self._lib.Write_image(
                     1,
-                    phase_mask.astype(np.uint8),
-                    phase_mask.size,
-                    0,
-                    0,
-                    5000  # 5 second timeout. Might block this long
+                    buffer.ctypes.data,
+                    buffer.size,
+                    int(wait_for_trigger),
+                    int(external_pulse),
+                    timeout_ms  # Might block this long
                 );
             except OSError:
                 return -1
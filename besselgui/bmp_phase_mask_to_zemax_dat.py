@@ -2,32 +2,118 @@
 """
 Created on Thu Dec 14 16:30:51 2023
 
+Converts phase mask images to Zemax grid phase .dat files. Each pixel becomes
+one line of text, so each distinct gray level is formatted once and the lines
+of the file are assembled from that table in large chunks.
+
+    python bmp_phase_mask_to_zemax_dat.py spots456.bmp
+    python bmp_phase_mask_to_zemax_dat.py R:\\holograms --processes 8
+
 @author: tuckes06
 """
 
 import os
-import numpy
-import imageio
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+DAT_CHUNK_PIXELS = 2**18  # Pixels formatted per write
+IMAGE_EXTENSIONS = ('.bmp', '.png', '.tif', '.tiff')
+
+
+def dat_filename(filename: str) -> str:
+    """
+    Return `filename` with its extension replaced by .dat if it is .dat or an image extension, otherwise with .dat
+    appended. Dots elsewhere in the name, i.e. 'N030_A0.12', are not taken as an extension.
+    """
+    base, extension = os.path.splitext(filename)
+    if extension.lower() in IMAGE_EXTENSIONS + ('.dat',):
+        filename = base
+    return filename + '.dat'
+
+
+def _line_table(values) -> (np.ndarray, np.ndarray):
+    """
+    Return the .dat line of each gray level in `values` as rows of a zero-padded uint8 array, and the length of each
+    line. Lines end in the platform's line separator, as when writing in text mode.
+    """
+    lines = ['{} 0.0 0.0 0.0 0{}'.format((dp / 255) * np.pi, os.linesep).encode('ascii') for dp in values]
+    lengths = np.array([len(line) for line in lines])
+    table = np.zeros((len(lines), lengths.max()), dtype=np.uint8)
+    for i, line in enumerate(lines):
+        table[i, :len(line)] = np.frombuffer(line, dtype=np.uint8)
+    return table, lengths
+
+
+def write_dat(z: np.ndarray, output_dat_path: str, pixel_size_um=15):
+    """Write the 2D gray level image `z` to a .dat file, streaming the pixel lines to disk in chunks."""
+    if z.dtype == np.uint8:
+        table, lengths = _line_table(np.arange(256, dtype=np.uint8))
+        index = z.ravel()
+    else:
+        values, index = np.unique(z.ravel(), return_inverse=True)
+        table, lengths = _line_table(values)
+    columns = np.arange(table.shape[1])
+    with open(output_dat_path, 'wb') as f:
+        f.write('{} {} {} {} 0.0 0.0{}'.format(z.shape[0], z.shape[1], pixel_size_um * 10**-3, pixel_size_um * 10**-3,
+                                               os.linesep).encode('ascii'))
+        for start in range(0, index.size, DAT_CHUNK_PIXELS):
+            chunk = index[start:start + DAT_CHUNK_PIXELS]
+            # Keep the unpadded bytes of each pixel's line, in order
+            f.write(table[chunk][columns[None, :] < lengths[chunk][:, None]].tobytes())
+
+
 def bmp_to_dat(path_to_bmp: str, output_dat_path=None, pixel_size_um=15):
+    import imageio
     if os.path.exists(path_to_bmp):
         if output_dat_path is None:
-            output_dat_path = path_to_bmp.split('.')[0] + '.dat'
+            output_dat_path = os.path.splitext(path_to_bmp)[0] + '.dat'
         im = imageio.v2.imread(path_to_bmp)
         if len(im.shape) > 2:
             z = im[:, :, 0]
         else:
             z = im
-        n = z.size  # Lines in resulting dat file
         print('Saving file to', output_dat_path)
-        with open(output_dat_path, 'w') as f:
-            f.write('{} {} {} {} 0.0 0.0\n'.format(z.shape[0], z.shape[1], pixel_size_um * 10**-3, pixel_size_um * 10**-3))
-            for i, dp in enumerate(z.flatten()):
-                v = (dp / 255) * np.pi 
-                f.write('{} 0.0 0.0 0.0 0\n'.format(v))
-                            
-                
+        write_dat(z, output_dat_path, pixel_size_um)
+        return output_dat_path
+
+
+def phase_mask_to_dat(phase_mask, output_dat_path: str):
+    """Write a bessel.PhaseMask to a .dat file in the orientation of PhaseMask.export, without going through a BMP."""
+    write_dat(np.rot90(phase_mask.mask), output_dat_path, pixel_size_um=phase_mask.pixel_size * 1000)
+    return output_dat_path
+
+
+def _convert(arguments):
+    return bmp_to_dat(*arguments)
+
+
+def convert_directory(directory: str, output_dir: str = None, pixel_size_um=15, processes=None) -> list:
+    """Convert every .bmp in `directory` to a .dat in `output_dir` (`directory` by default) in a pool of processes."""
+    output_dir = directory if output_dir is None else output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [
+        (os.path.join(directory, name), os.path.join(output_dir, os.path.splitext(name)[0] + '.dat'), pixel_size_um)
+        for name in sorted(os.listdir(directory)) if name.lower().endswith('.bmp')
+    ]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_convert, jobs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert phase mask images to Zemax grid phase .dat files.')
+    parser.add_argument('path', help='A .bmp file or a directory of them')
+    parser.add_argument('--output', default=None, help='Output .dat file, or directory if `path` is a directory')
+    parser.add_argument('--pixel-size-um', type=float, default=15)
+    parser.add_argument('--processes', type=int, default=None, help='Worker processes for directories (default: number of CPUs)')
+    args = parser.parse_args(argv)
+    if os.path.isdir(args.path):
+        converted = convert_directory(args.path, args.output, args.pixel_size_um, args.processes)
+        print('Converted {} masks'.format(len(converted)))
+    else:
+        bmp_to_dat(args.path, args.output, args.pixel_size_um)
+
+
 if __name__ == "__main__":
-    bmp_to_dat(r"R:\shohas01lab\shohas01labspace\Darnel\Holography\SLM\holograms\1st_order_spots\spots456.bmp", output_dat_path='spots456.dat')
-    # bmp_to_dat(r"R:\shohas01lab\shohas01labspace\Darnel\Holography\SLM\holograms\1st_order_spots\spots264.bmp", output_dat_path='spots264.dat')
+    sys.exit(main())
@@ -15,32 +15,19 @@ import usb
 import pyvisa as visa
 from ThorlabsPM100 import ThorlabsPM100
 from Meadowlark_Blink_C import Blink
+from calibration import grating, CalibrationEngine, ThorlabsPowerMeter, SettlingDetector
+from lut import fit_luts
 import numpy as np
 import matplotlib.pyplot as plt
 import time
 import datetime
-import csv
 
 DEFAULT_MEADOWLARK_API_DIR = r'C:\Program Files\Meadowlark Optics\Blink OverDrive Plus\SDK'
 DEFAULT_LINEAR_LUT_PATH = 'linear.lut'
 
 
-def grating(size, n, gray_level, region='all'):
-    if gray_level not in range(256):
-        raise ValueError('gray_level must be uint8')
-    g = np.zeros(size, dtype=np.uint8)
-    for i in range(n):
-        g[i::n*2, :] = np.uint8(gray_level)
-    if region != 'all' and region in range(64):
-        rx = size[0] // 8
-        ry = size[1] // 8
-        i = region % 8
-        j = region // 8
-        mask = np.zeros(size)
-        mask[rx*i:rx*i+rx, ry*j:ry*j+ry] = 1
-        g = g * mask
-    return g
-    
+def print_power(region, gray_level, pwr, reads):
+    print("{} - {} {} mW ({} readings)".format(str(gray_level).zfill(3), '|'*int(pwr / 2.5), str(pwr)[0:5], reads))
 
 
 if __name__ == "__main__":
@@ -83,11 +70,8 @@ SLM prior to running this script."""
     print('Power meter connected:', inst.query("*IDN?"))
     power_meter.system.beeper.immediate()
     
-    print('Setting mode to POW...')
-    power_meter.configure.scalar.power()
-    
-    print('Setting average count to 100...\n')
-    power_meter.sense.average.count = 100
+    print('Setting mode to POW and average count to 10...\n')
+    power_meter = ThorlabsPowerMeter(power_meter, average_count=10)  # Readings are repeated until the power settles
     
     # Connect to SLM
 
@@ -122,8 +106,7 @@ SLM prior to running this script."""
     
     # Configure calibration session
     
-    lambda_min = int(power_meter.sense.correction.minimum_wavelength)
-    lambda_max = int(power_meter.sense.correction.maximum_wavelength)
+    lambda_min, lambda_max = power_meter.wavelength_range
     
     wavelength = 0
     while wavelength not in range(lambda_min, lambda_max):
@@ -131,7 +114,7 @@ SLM prior to running this script."""
         if wavelength not in range(lambda_min, lambda_max):
             print('Power meter wavelength range is {} nm to {} nm.'.format(lambda_min, lambda_max))
     
-    power_meter.sense.correction.wavelength = wavelength
+    power_meter.set_wavelength(wavelength)
     
     if input('Global calibration (g) or regional calibration (r)? ') == 'r':
         regions = range(64)
@@ -150,7 +133,7 @@ SLM prior to running this script."""
         print("Please configure your optical system for 0th order measurement.")
         print('The light reflected from the SLM should form several spots. Arrange the iris and power meter such that only the center spot is detected.')
     
-    blink.Write_image(g.flatten(order='F'))
+    blink.Write_image(g)
     
     v = None
     while True:
@@ -160,33 +143,21 @@ SLM prior to running this script."""
         if int(v) in range(256):
             g_pitch = int(v)
             g = grating(slm_dimensions, g_pitch, 255)
-            blink.Write_image(g.flatten(order='F'))
+            blink.Write_image(g)
 
     date = datetime.datetime.now().strftime("%m-%d-%Y-%H-%M-%S")
     output_dir = 'slm-calib-' + str(wavelength) + 'nm-' + str(date)
     os.mkdir(output_dir)
     print('\rSaving Meadowlark calibration files to', output_dir)
     
+    engine = CalibrationEngine(blink, power_meter, slm_dimensions, g_pitch, settling=SettlingDetector())
     for region in regions:
         print('\n Recording 0th order power for region', region)
-        gray_levels = range(256)
-        zero_order_pwr = np.empty(256)
-        for i, gray_level in enumerate(gray_levels):
-            g = grating(slm_dimensions, g_pitch, gray_level, region=region)
-            blink.Write_image(g.flatten(order='F'))
-            time.sleep(0.05)  # Generous SLM settling time
-            pwr = power_meter.read * 1000  # mW
-            print("{} - {} {} mW".format(str(gray_level).zfill(3), '|'*int(pwr / 2.5), str(pwr)[0:5]))
-            zero_order_pwr[i] = pwr
-        if region == 'all':
-            rstr = '0'
-        else:
-            rstr = str(region)
-        with open(os.path.join(output_dir, 'Raw{}.csv'.format(rstr)), 'a') as file:
-            writer = csv.writer(file)
-            for d, p in zip(gray_levels, zero_order_pwr):
-                writer.writerow([str(d), str(p)])
+        engine.run([region], output_dir, progress=print_power)
     
     print('\rDone! calibration data saved to', output_dir)
     
+    luts = fit_luts(output_dir, order=1 if len(regions) > 1 else 0)  # Regional calibration measures the 1st order
+    print('Fit LUTs for {} region(s) and saved them to {}'.format(len(luts), output_dir))
+    
 
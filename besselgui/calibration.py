@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 16:48:30 2026
+
+Acquisition engine for SLM phase calibration. For each region of the SLM, a
+grating is displayed at every gray level and the power in the 0th (or 1st)
+diffraction order is recorded. Instead of waiting a fixed time after each
+frame, the power meter is read until consecutive readings agree.
+
+Power meters are accessed through PowerMeter so that the engine can be run
+against a SimulatedPowerMeter and a mock_blink.MockBlink offline:
+
+    python calibration.py --regions 2
+
+@author: sstucker
+"""
+
+import os
+import sys
+import csv
+import time
+import argparse
+import numpy as np
+
+
+class GratingGenerator():
+    """
+    Calibration gratings of `pitch` pixels: rows x with x mod 2 `pitch` < `pitch` are at the gray level and the rest
+    are 0. For regional calibration the SLM is divided into a `layout` (nx, ny) grid of regions numbered along x
+    first, and the grating is only displayed within one region. Gratings are broadcast from a (256, width) table of
+    rows, so they can be had as views or written into a reusable buffer without float intermediates.
+    """
+
+    def __init__(self, size, pitch: int, layout=(8, 8)):
+        self.size = tuple(size)
+        self.pitch = pitch
+        self.layout = tuple(layout)
+        rows = (np.arange(self.size[0]) % (2 * pitch)) < pitch
+        self.levels = np.outer(np.arange(256, dtype=np.uint8), rows.astype(np.uint8))  # levels[g] is the row profile at g
+
+    @property
+    def regions(self) -> int:
+        return self.layout[0] * self.layout[1]
+
+    def region_slices(self, region='all') -> (slice, slice):
+        if region == 'all':
+            return slice(None), slice(None)
+        if region not in range(self.regions):
+            raise ValueError("region must be 'all' or in range({}), not {}".format(self.regions, region))
+        rx = self.size[0] // self.layout[0]
+        ry = self.size[1] // self.layout[1]
+        i = region % self.layout[0]
+        j = region // self.layout[0]
+        return slice(rx*i, rx*i+rx), slice(ry*j, ry*j+ry)
+
+    def view(self, gray_level: int, region='all') -> np.ndarray:
+        """Return a read-only view of the grating within `region`, of the shape of the region."""
+        if gray_level not in range(256):
+            raise ValueError('gray_level must be uint8')
+        sx, sy = self.region_slices(region)
+        block = self.levels[gray_level, sx]
+        return np.broadcast_to(block[:, None], (block.shape[0], len(range(*sy.indices(self.size[1])))))
+
+    def render(self, gray_level: int, region='all', out: np.ndarray = None) -> np.ndarray:
+        """Return the full-frame grating, written into `out` if given, which is allocated Fortran-ordered otherwise."""
+        if out is None:
+            out = np.empty(self.size, dtype=np.uint8, order='F')
+        sx, sy = self.region_slices(region)
+        if region != 'all':
+            out[...] = 0
+        out[sx, sy] = self.view(gray_level, region)
+        return out
+
+
+def grating(size, n, gray_level, region='all', layout=(8, 8)):
+    return GratingGenerator(size, n, layout).render(gray_level, region)
+
+
+class PowerMeter():
+    """Interface to a power meter used for calibration."""
+
+    def read(self) -> float:
+        """Return a single power reading in mW."""
+        raise NotImplementedError()
+
+    def set_wavelength(self, wavelength_nm: float):
+        pass
+
+
+class ThorlabsPowerMeter(PowerMeter):
+    """
+    Adapter for a ThorlabsPM100.ThorlabsPM100 instance. The meter's averaging is lowered to `average_count` samples
+    per reading since readings are repeated until they settle anyway.
+    """
+
+    def __init__(self, device, average_count: int = 10):
+        self.device = device
+        self.device.configure.scalar.power()
+        self.device.sense.average.count = average_count
+
+    def read(self) -> float:
+        return self.device.read * 1000  # mW
+
+    def set_wavelength(self, wavelength_nm: float):
+        self.device.sense.correction.wavelength = wavelength_nm
+
+    @property
+    def wavelength_range(self) -> (int, int):
+        return int(self.device.sense.correction.minimum_wavelength), int(self.device.sense.correction.maximum_wavelength)
+
+
+class SimulatedPowerMeter(PowerMeter):
+    """
+    Power in the 0th order of a simulated SLM, a mock_blink.MockBlink which must record frames. The SLM's phase
+    response to gray level g is 2 pi `phase_stroke` (g / 255) ** `gamma`. After each write the power approaches that
+    of the new frame exponentially with time constant `settle_time` (s). Each reading takes `read_time` (s) and has
+    Gaussian noise with standard deviation `noise` relative to `max_power` (mW).
+    """
+
+    def __init__(self, slm, max_power: float = 10.0, phase_stroke: float = 1.1, gamma: float = 1.3,
+                 settle_time: float = 0.01, read_time: float = 0.003, noise: float = 0.001, seed: int = None):
+        self.slm = slm
+        self.max_power = max_power
+        self.settle_time = settle_time
+        self.read_time = read_time
+        self.noise = noise
+        self.phase_response = 2 * np.pi * phase_stroke * (np.arange(256) / 255) ** gamma
+        self.reads = 0
+        self._rng = np.random.default_rng(seed)
+        self._writes_seen = 0
+        self._start = 0.0  # Power when the last frame was written, relative to max_power
+        self._target = 0.0  # Settled power of the last frame
+        self._written_at = 0.0
+
+    def _zero_order(self, frame: np.ndarray) -> float:
+        # The 0th order field is the mean of exp(i phase) over all pixels, which only depends on the histogram
+        counts = np.bincount(frame, minlength=256)
+        return np.abs(np.dot(counts, np.exp(1j * self.phase_response)) / frame.size)**2
+
+    def _power(self, t: float) -> float:
+        return self._target + (self._start - self._target) * np.exp(-max(t - self._written_at, 0) / self.settle_time)
+
+    def read(self) -> float:
+        time.sleep(self.read_time)
+        library = self.slm.library
+        if library.writes != self._writes_seen and len(library.frames) > 0:
+            self._writes_seen = library.writes
+            written_at = library.write_times[-1]
+            self._start = self._power(written_at)
+            self._target = self._zero_order(library.frames[-1])
+            self._written_at = written_at
+        self.reads += 1
+        return self.max_power * (self._power(time.perf_counter()) + self.noise * self._rng.normal())
+
+
+class SettlingDetector():
+    """
+    Reads a power meter until the last `window` readings lie within `tolerance` (relative to their mean, or at least
+    `absolute_tolerance` mW) of one another, and returns their mean. Gives up after `max_reads` and returns the mean
+    of the last window.
+    """
+
+    def __init__(self, window: int = 4, tolerance: float = 0.005, absolute_tolerance: float = 0.02, max_reads: int = 50):
+        self.window = window
+        self.tolerance = tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.max_reads = max_reads
+
+    def measure(self, power_meter: PowerMeter) -> (float, int):
+        """Return the settled power and the number of readings taken."""
+        readings = []
+        while True:
+            readings.append(power_meter.read())
+            recent = readings[-self.window:]
+            if len(recent) == self.window:
+                mean = sum(recent) / self.window
+                if max(recent) - min(recent) <= max(self.tolerance * abs(mean), self.absolute_tolerance):
+                    return mean, len(readings)
+                if len(readings) >= self.max_reads:
+                    return mean, len(readings)
+
+
+class FixedDelay():
+    """Settling by a fixed wait followed by a single reading, as calibrate.py used to do."""
+
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+
+    def measure(self, power_meter: PowerMeter) -> (float, int):
+        time.sleep(self.delay)
+        return power_meter.read(), 1
+
+
+def write_raw_csv(path: str, gray_levels, powers):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for d, p in zip(gray_levels, powers):
+            writer.writerow([str(d), str(p)])
+
+
+def raw_csv_name(region) -> str:
+    return 'Raw{}.csv'.format('0' if region == 'all' else region)
+
+
+class CalibrationEngine():
+    """
+    Displays the calibration grating of pitch `pitch` on `slm` and measures the power with `power_meter` using
+    `settling`, a SettlingDetector by default. Regions are numbered in a `layout` grid, see GratingGenerator. Each
+    frame is rendered straight into the SLM's upload buffer.
+    """
+
+    def __init__(self, slm, power_meter: PowerMeter, dimensions, pitch: int, settling=None, layout=(8, 8)):
+        self.slm = slm
+        self.power_meter = power_meter
+        self.dimensions = tuple(dimensions)
+        self.settling = SettlingDetector() if settling is None else settling
+        self.layout = tuple(layout)
+        self.reads = 0
+        self.frames = 0
+        self.pitch = pitch
+
+    @property
+    def pitch(self) -> int:
+        return self.gratings.pitch
+
+    @pitch.setter
+    def pitch(self, pitch: int):
+        self.gratings = GratingGenerator(self.dimensions, pitch, self.layout)
+
+    def show(self, region, gray_level: int) -> int:
+        """Write the grating of `region` at `gray_level` to the SLM and return the status of the write."""
+        self.gratings.render(gray_level, region, out=self.slm.frame(self.dimensions))
+        self.frames += 1
+        return self.slm.Write_image()
+
+    def measure(self, region='all', gray_levels=range(256), progress=None) -> np.ndarray:
+        """
+        Return the settled power (mW) at each gray level of `region`. `progress` is called with
+        (region, gray_level, power, number_of_readings) after each gray level.
+        """
+        powers = np.empty(len(gray_levels))
+        for i, gray_level in enumerate(gray_levels):
+            self.show(region, gray_level)
+            powers[i], reads = self.settling.measure(self.power_meter)
+            self.reads += reads
+            if progress is not None:
+                progress(region, gray_level, powers[i], reads)
+        return powers
+
+    def run(self, regions, output_dir: str = None, gray_levels=range(256), progress=None) -> dict:
+        """Measure each region, writing Raw{region}.csv files to `output_dir` if given. Returns powers by region."""
+        results = {}
+        for region in regions:
+            results[region] = self.measure(region, gray_levels, progress)
+            if output_dir is not None:
+                write_raw_csv(os.path.join(output_dir, raw_csv_name(region)), gray_levels, results[region])
+        return results
+
+
+def main(argv=None):
+    from mock_blink import MockBlink
+
+    parser = argparse.ArgumentParser(description='Benchmark the calibration engine against a simulated SLM and power meter.')
+    parser.add_argument('--regions', type=int, default=1, help='Number of regions to measure')
+    parser.add_argument('--dims', nargs=2, type=int, default=[1920, 1152], metavar=('X', 'Y'))
+    parser.add_argument('--pitch', type=int, default=4)
+    parser.add_argument('--settle-time', type=float, default=0.01, help='Simulated SLM settling time constant (s)')
+    parser.add_argument('--fixed-delay', type=float, default=None, help='Compare against a fixed settling delay (s)')
+    args = parser.parse_args(argv)
+
+    regions = ['all'] if args.regions == 1 else range(args.regions)
+    settlings = [('adaptive', SettlingDetector())]
+    if args.fixed_delay is not None:
+        settlings.append(('fixed {} s'.format(args.fixed_delay), FixedDelay(args.fixed_delay)))
+    for name, settling in settlings:
+        slm = MockBlink(dimensions=args.dims, max_recorded=1)
+        slm.Create_SDK()
+        meter = SimulatedPowerMeter(slm, settle_time=args.settle_time, seed=0)
+        engine = CalibrationEngine(slm, meter, args.dims, args.pitch, settling=settling)
+        start = time.perf_counter()
+        results = engine.run(regions)
+        elapsed = time.perf_counter() - start
+        # Compare against the settled response to see what the settling costs in accuracy
+        expected = np.cos(meter.phase_response / 2)**2 * meter.max_power
+        error = np.max(np.abs(results[regions[0]] - expected)) if regions == ['all'] else float('nan')
+        print('{}: {} frames in {:.2f} s ({:.1f} ms/frame), {:.2f} readings/frame, max error {:.4f} mW'.format(
+            name, engine.frames, elapsed, elapsed / engine.frames * 1000, engine.reads / engine.frames, error))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
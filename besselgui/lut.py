@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 17:35:04 2026
+
+Turns the Raw{region}.csv power measurements written by calibrate.py into
+Meadowlark .lut files. All regions are processed at once as rows of one array.
+
+A 50% duty grating between gray level 0 and g diffracts cos^2(phi(g) / 2) of
+the power into the 0th order and sin^2(phi(g) / 2) into the 1st order, where
+phi(g) is the phase difference between the two levels. The phase response is
+recovered with arccos or arcsin of the normalized power, unwrapping the branch
+at each extremum of the measurement, and is then inverted so that the 256
+levels of the LUT are spaced evenly over one wave.
+
+    python lut.py slm-calib-1040nm-10-17-2026-17-35-04
+
+@author: sstucker
+"""
+
+import os
+import re
+import sys
+import argparse
+import numpy as np
+
+DEFAULT_BASE_LUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'linear.lut')
+
+
+def read_lut(path: str) -> np.ndarray:
+    """Return the drive value of each gray level in a .lut file."""
+    with open(path) as file:
+        table = np.array(file.read().split(), dtype=np.int64).reshape(-1, 2)
+    return table[np.argsort(table[:, 0]), 1]
+
+
+def write_lut(path: str, drives):
+    """Write a .lut file in the format of linear.lut: 'level<TAB>drive' lines without a trailing newline."""
+    drives = np.asarray(drives, dtype=np.int64)
+    with open(path, 'w', newline='') as file:
+        file.write('\n'.join('{}\t{}'.format(level, drive) for level, drive in enumerate(drives)))
+
+
+def raw_csv_paths(directory: str) -> dict:
+    """Return the paths of the Raw{region}.csv files in `directory` by region number."""
+    paths = {}
+    for name in os.listdir(directory):
+        match = re.fullmatch(r'Raw(\d+)\.csv', name)
+        if match:
+            paths[int(match.group(1))] = os.path.join(directory, name)
+    return dict(sorted(paths.items()))
+
+
+def load_raw(directory: str) -> (list, np.ndarray, np.ndarray):
+    """
+    Load all Raw{region}.csv files in `directory`. Returns the region numbers, the gray levels and the (regions,
+    gray levels) array of powers.
+    """
+    paths = raw_csv_paths(directory)
+    if len(paths) == 0:
+        raise ValueError('No Raw*.csv files in {}'.format(directory))
+    text = []
+    for path in paths.values():
+        with open(path) as file:
+            text.append(file.read())
+    # Parse every file in one pass rather than one csv reader per file
+    table = np.array(' '.join(text).replace(',', ' ').split(), dtype=float).reshape(len(paths), -1, 2)
+    gray_levels = table[0, :, 0]
+    if np.any(table[:, :, 0] != gray_levels):
+        raise ValueError('Raw*.csv files in {} do not share the same gray levels'.format(directory))
+    return list(paths.keys()), gray_levels.astype(int), table[:, :, 1]
+
+
+def _smooth(x: np.ndarray, width: int) -> np.ndarray:
+    """Moving average along the last axis, with the ends padded by their edge values."""
+    if width < 2:
+        return x
+    pad = width // 2
+    padded = np.pad(x, [(0, 0)] * (x.ndim - 1) + [(pad, width - 1 - pad)], mode='edge')
+    cumulative = np.cumsum(padded, axis=-1)
+    cumulative = np.concatenate([np.zeros(x.shape[:-1] + (1,)), cumulative], axis=-1)
+    return (cumulative[..., width:] - cumulative[..., :-width]) / width
+
+
+def phase_response(powers: np.ndarray, order: int = 0, smoothing: int = 5, threshold: float = 0.2) -> np.ndarray:
+    """
+    Return the phase (rad) at each gray level of each row of `powers`, measured in diffraction order `order` (0 or
+    1). Powers are smoothed with a moving average of `smoothing` gray levels and normalized to their range. The
+    branch of the arccos (0th order) or arcsin (1st order) is advanced at each local extremum of the smoothed curve
+    which lies within `threshold` of 0 or 1.
+    """
+    powers = np.atleast_2d(np.asarray(powers, dtype=float))
+    smoothed = _smooth(powers, smoothing)
+    low = smoothed.min(axis=1, keepdims=True)
+    high = smoothed.max(axis=1, keepdims=True)
+    smoothed = (smoothed - low) / (high - low)
+    if order == 0:
+        theta = 2 * np.arccos(np.sqrt(smoothed))
+    elif order == 1:
+        theta = 2 * np.arcsin(np.sqrt(smoothed))
+    else:
+        raise ValueError('order must be 0 or 1, not {}'.format(order))
+    # Extrema are where the slope of the smoothed curve changes sign, ignoring flat steps
+    slope = np.sign(np.diff(smoothed, axis=1))
+    slope[slope == 0] = 1
+    turning = np.zeros(powers.shape, dtype=bool)
+    turning[:, 1:-1] = slope[:, 1:] != slope[:, :-1]
+    turning &= (smoothed < threshold) | (smoothed > 1 - threshold)
+    # Noise can register one extremum twice. Only count turning points which alternate in kind, starting with the
+    # opposite of the extremum at gray level 0 (a maximum of the 0th order, a minimum of the 1st)
+    rows, columns = np.nonzero(turning)
+    kinds = np.where(smoothed[rows, columns] < 0.5, -1, 1)
+    previous = np.concatenate([[0], kinds[:-1]])
+    previous[np.concatenate([[True], rows[1:] != rows[:-1]])] = -1 if order == 1 else 1
+    keep = kinds != previous
+    counted = np.zeros(powers.shape, dtype=int)
+    counted[rows[keep], columns[keep]] = 1
+    branch = np.cumsum(counted, axis=1)
+    phase = np.pi * branch + np.where(branch % 2 == 0, theta, np.pi - theta)
+    phase = np.maximum.accumulate(phase, axis=1)  # The response of the liquid crystal is monotonic
+    return phase - phase[:, :1]
+
+
+def invert(phases: np.ndarray, gray_levels, base_lut: np.ndarray = None, levels: int = 256) -> np.ndarray:
+    """
+    Return the (regions, `levels`) drive values which produce phases spaced evenly over one wave, given the phase
+    at each gray level of each region. Gray levels were displayed through `base_lut` (linear.lut by default), so the
+    gray level reaching each phase is mapped through it to a drive value. Phases beyond the stroke of a region are
+    clipped to its largest gray level.
+    """
+    phases = np.atleast_2d(phases)
+    gray_levels = np.asarray(gray_levels, dtype=float)
+    if base_lut is None:
+        base_lut = read_lut(DEFAULT_BASE_LUT_PATH)
+    targets = 2 * np.pi * np.arange(levels) / levels
+    # Interpolate within the monotonic phase curve of every region at once
+    above = np.sum(phases[:, :, None] < targets[None, None, :], axis=1)  # Index of the first phase >= target
+    above = np.clip(above, 1, phases.shape[1] - 1)
+    rows = np.arange(phases.shape[0])[:, None]
+    p0, p1 = phases[rows, above - 1], phases[rows, above]
+    fraction = np.clip(np.divide(targets - p0, p1 - p0, out=np.zeros_like(p0), where=p1 > p0), 0, 1)
+    gray = gray_levels[above - 1] + fraction * (gray_levels[above] - gray_levels[above - 1])
+    gray[targets[None, :] > phases[:, -1:]] = gray_levels[-1]
+    drives = np.interp(gray, np.arange(len(base_lut)), base_lut)
+    return np.rint(drives).astype(np.int64)
+
+
+def lut_name(region: int) -> str:
+    return 'Region{}.lut'.format(region)
+
+
+def fit_luts(directory: str, output_dir: str = None, order: int = 0, base_lut: np.ndarray = None) -> dict:
+    """
+    Fit a LUT to each Raw{region}.csv in `directory` and write them to `output_dir`, `directory` by default, as
+    Region{region}.lut. Returns the drive values by region.
+    """
+    regions, gray_levels, powers = load_raw(directory)
+    drives = invert(phase_response(powers, order=order), gray_levels, base_lut)
+    output_dir = directory if output_dir is None else output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    for region, lut in zip(regions, drives):
+        write_lut(os.path.join(output_dir, lut_name(region)), lut)
+    return dict(zip(regions, drives))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fit Meadowlark LUT files to Raw*.csv calibration measurements.')
+    parser.add_argument('directory')
+    parser.add_argument('--output-dir', default=None)
+    parser.add_argument('--order', type=int, default=0, choices=[0, 1], help='Diffraction order which was measured')
+    parser.add_argument('--base-lut', default=DEFAULT_BASE_LUT_PATH, help='LUT loaded during the measurement')
+    args = parser.parse_args(argv)
+    luts = fit_luts(args.directory, args.output_dir, args.order, read_lut(args.base_lut))
+    print('Wrote {} LUT(s) to {}'.format(len(luts), args.output_dir or args.directory))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
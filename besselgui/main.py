@@ -2,117 +2,129 @@ import tkinter as tk
 import tkinter.filedialog
 import numpy as np
 import random
-from numba import jit
 import time
 import os
 import sys
+import threading
 from Meadowlark_Blink_C import Blink
-
-@jit
-def add_radial_sections(mask1, mask2, offset=(0, 0), sections=128):
-    θs = np.linspace(0, 2 * np.pi, sections + 1)[:-1]
-    dθ = θs[1] - θs[0]
-    theta_bounds = []
-    for θ in θs[::2]:
-        theta_bounds.append((θ, θ + dθ))
-    for i, x in enumerate(np.arange(mask1.shape[0]) - mask1.shape[0] // 2):
-        for j, y in enumerate(np.arange(mask2.shape[1]) - mask2.shape[1] // 2):
-            θ = np.arctan2(-x - offset[0], -y - offset[1]) + np.pi
-            for bounds in theta_bounds:
-                if θ >= bounds[0] and θ < bounds[1]:
-                    mask1[i, j] = mask2[i, j]
-    return mask1
-
-
-def generate_mask(parameters: dict) -> np.ndarray:
-    ellip_radians = (
-        parameters['mask-ellipticity'][0] * np.pi / 180,
-        parameters['mask-ellipticity'][1] * np.pi / 180
-    )
-    ax1 = np.zeros(parameters['slm-dimensions'], dtype=np.uint16)
-    if parameters['axicon-1-enabled']:
-        ax1 = axicon_mask(
-            parameters['slm-dimensions'],
-            parameters['period-1'],
-            ellip_radians,
-            parameters['mask-offset']
-        )
-    if parameters['axicon-2-enabled']:
-        ax2 = axicon_mask(
-            parameters['slm-dimensions'],
-            parameters['period-2'],
-            ellip_radians,
-            parameters['mask-offset']
-        )
-        ax1 = add_radial_sections(ax1, ax2, offset=parameters['mask-offset'], sections=64)
-    if parameters['lens-enabled']:
-        lens = lens_mask(
-            parameters['slm-dimensions'],
-            parameters['lens-f'],
-            ellip_radians,
-            parameters['mask-offset']  
-        )
-        ax1 = (ax1 + lens) % 255
-    if parameters['ramp-enabled']:
-        ramp = ramp_mask(
-            parameters['slm-dimensions'],
-            *parameters['ramp-slope']
+from worker import LatestOnlyWorker
+from mock_blink import mock_from_environment
+from mask_cache import default_cache, enable_default_cache
+from masks import axicon_mask, lens_mask, ramp_mask, add_mod, composite_sectors, sector_stack, memory_order, LRUCache
+
+WORKER_POLL_INTERVAL_MS = 15  # How often the Tk main loop checks for masks finished by the worker
+DISPLAY_CACHE_MB = 256  # Default budget for the masks and previews of recently displayed parameters
+UNRENDERED_PARAMETERS = ('mask-contour',)  # Parameters which do not change the mask, left out of cache keys
+
+
+class MaskCompositor():
+    """
+    Renders masks from the GUI's parameters incrementally. The axicon, lens and ramp layers are each kept with the
+    parameters they were rendered from, so only layers whose parameters changed are rendered again. The enabled
+    layers are then combined with one fused add modulo 255 into the output.
+    """
+    
+    def __init__(self):
+        self._layers = {}  # Layer name -> (parameters, array)
+        self._lock = threading.Lock()  # Layers are shared between callers
+        self.rendered = 0  # Number of layer renders, for profiling
+    
+    def _layer(self, name: str, key: tuple, dimensions, order: str, render) -> np.ndarray:
+        """Return layer `name`, calling render(out) only if it was last rendered with a different `key`."""
+        key = (tuple(dimensions), order) + key
+        cached_key, layer = self._layers.get(name, (None, None))
+        if cached_key == key:
+            return layer
+        if layer is None or cached_key[:2] != key[:2]:
+            # Layers are kept in the memory order of the output so that adding them is a contiguous pass
+            layer = np.empty(dimensions, dtype=np.uint8, order=order)
+        render(layer)
+        self._layers[name] = (key, layer)
+        self.rendered += 1
+        return layer
+    
+    def clear(self):
+        with self._lock:
+            self._layers.clear()
+    
+    def render(self, parameters: dict, out: np.ndarray = None) -> np.ndarray:
+        ellip_radians = (
+            parameters['mask-ellipticity'][0] * np.pi / 180,
+            parameters['mask-ellipticity'][1] * np.pi / 180
         )
-        ax1 = (ax1 + ramp) % 255
-    return ax1.astype(np.uint8)
-
-
-def ramp_mask(dimensions: np.ndarray, slope_x: float, slope_y: float):
-    mask = np.zeros(dimensions)
-    return _ramp_mask(mask.astype(float), dimensions, slope_x, slope_y)
-
-@jit
-def _ramp_mask(mask: np.ndarray, dimensions: np.ndarray, slope_x: float, slope_y: float):
-    for i, x in enumerate(np.arange(dimensions[0])):
-        for j, y in enumerate(np.arange(dimensions[1])):
-            mask[i, j] = x * slope_x + y * slope_y
-    return (mask % 255).astype(np.uint8)
-
-
-def lens_mask(dimensions: np.ndarray, focal_length: float, alpha: tuple, offset: tuple) -> np.ndarray:
-    mask = np.zeros(dimensions).astype(np.uint16)
-    if focal_length != 0:
-        _lens_mask(mask, focal_length, *alpha, *offset)
-    return mask
-
-
-@jit
-def _lens_mask(mask: np.ndarray, focal_length: float, alpha_x: float, alpha_y: float, offset_x: int, offset_y: int):
-    holo_x: int = mask.shape[0] // 2
-    holo_y: int = mask.shape[1] // 2
-    b2_x: float = np.cos(alpha_x)**2
-    b2_y: float = np.cos(alpha_y)**2
-    for i, x in enumerate(np.linspace(-holo_x, holo_x, mask.shape[0]).astype(np.float32)):
-        for j, y in enumerate(np.linspace(-holo_y, holo_y, mask.shape[1]).astype(np.float32)):
-            mask[i, j] = int((b2_x * (x + offset_x)**2 + b2_y * (y + offset_y)**2) / (2 * focal_length)) % 255
-
-
-def axicon_mask(dimensions: np.ndarray, period: int, alpha: tuple, offset: tuple, greylevel: int = 255) -> np.ndarray:
-    mask = np.zeros(dimensions).astype(np.uint16)
-    _axicon_mask(mask, period, *alpha, *offset)
-    mask = ((mask / np.max(mask)) * min(greylevel, 255)).astype(np.uint16)
-    return mask
-
-
-@jit
-def _axicon_mask(mask: np.ndarray, period: int, alpha_x: float, alpha_y: float, offset_x: int, offset_y: int):
-    holo_x: int = mask.shape[0] // 2
-    holo_y: int = mask.shape[1] // 2
-    b2_x: float = np.cos(alpha_x)**2
-    b2_y: float = np.cos(alpha_y)**2
-    for i, x in enumerate(np.linspace(-holo_x, holo_x, mask.shape[0]).astype(np.float32)):
-        for j, y in enumerate(np.linspace(-holo_y, holo_y, mask.shape[1]).astype(np.float32)):
-            mask[i, j] = period - int(np.sqrt(b2_x * (x + offset_x)**2 + b2_y * (y + offset_y)**2)) % period
+        dimensions = parameters['slm-dimensions']
+        offset = parameters['mask-offset']
+        if out is None:
+            out = np.empty(dimensions, dtype=np.uint8)
+        order = memory_order(out)
+        
+        def render_axicons(layer):
+            if parameters['axicon-2-enabled']:
+                # Axicon 2 fills every other angular sector of axicon 1
+                stack = sector_stack(dimensions, 2, order)
+                axicon_mask(dimensions, parameters['period-2'], ellip_radians, offset, out=stack[0])
+                if parameters['axicon-1-enabled']:
+                    axicon_mask(dimensions, parameters['period-1'], ellip_radians, offset, out=stack[1])
+                else:
+                    stack[1] = 0
+                composite_sectors(stack, sections=64, offset=offset, out=layer)
+            elif parameters['axicon-1-enabled']:
+                axicon_mask(dimensions, parameters['period-1'], ellip_radians, offset, out=layer)
+            else:
+                layer[...] = 0
+        
+        with self._lock:
+            layers = [self._layer('axicons', (
+                parameters['axicon-1-enabled'] and parameters['period-1'],
+                parameters['axicon-2-enabled'] and parameters['period-2'],
+                ellip_radians,
+                offset
+            ), dimensions, order, render_axicons)]
+            if parameters['lens-enabled']:
+                layers.append(self._layer('lens', (parameters['lens-f'], ellip_radians, offset), dimensions, order,
+                                          lambda layer: lens_mask(dimensions, parameters['lens-f'], ellip_radians, offset, out=layer)))
+            if parameters['ramp-enabled']:
+                layers.append(self._layer('ramp', tuple(parameters['ramp-slope']), dimensions, order,
+                                          lambda layer: ramp_mask(dimensions, *parameters['ramp-slope'], out=layer)))
+            return add_mod(*layers, out=out)
+
+
+_COMPOSITOR = MaskCompositor()
+
+
+def generate_mask(parameters: dict, out: np.ndarray = None) -> np.ndarray:
+    """Render the mask for the GUI's parameters into `out`, reusing the layers of previous calls which still apply."""
+    return _COMPOSITOR.render(parameters, out)
+
+
+def rendered_parameters(parameters: dict) -> dict:
+    """The parameters which the mask depends on, so that masks which only differ in other parameters share a key."""
+    return {name: value for name, value in parameters.items() if name not in UNRENDERED_PARAMETERS}
+
+
+def generate_cached_mask(parameters: dict, out: np.ndarray = None, cache=None) -> np.ndarray:
+    """
+    generate_mask() through a mask_cache.MaskCache, default_cache() unless one is given. Without `out`, cached masks
+    are returned as read-only memory maps.
+    """
+    cache = default_cache() if cache is None else cache
+    if cache is None:
+        return generate_mask(parameters, out)
+    key = {'generator': 'generate_mask', 'version': 1, 'parameters': rendered_parameters(parameters)}
+    cached = cache.get(key)
+    if cached is None:
+        mask = generate_mask(parameters, out)
+        cache.put(key, mask)
+        return mask
+    if out is None:
+        return cached
+    out[...] = cached
+    return out
 
 
 class BesselGui(tk.Tk):
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, display_cache_mb=DISPLAY_CACHE_MB, **kwargs):
         tk.Tk.__init__(self, *args, **kwargs)
         self.title('BesselGUI v0.1')
         self.iconbitmap('icon.ico')
@@ -123,8 +135,16 @@ class BesselGui(tk.Tk):
         self.path_to_meadowlark_lib = None  # TODO generalize to other SLMs... but there are enough SLM apps. Maybe TODO use slmsuite as backend
         self.path_to_calib_file = None
         self.slm_api = None
+        self._slm_lock = threading.Lock()  # Serializes calls into the SLM API between the UI and the worker
         # -------------------
         
+        # Final masks and their previews of recently displayed parameters, only used by the worker
+        self._display_cache = LRUCache(max_bytes=int(display_cache_mb * 2**20))
+        
+        # Masks are generated and uploaded by a worker thread which only ever processes the latest parameters
+        self._worker = LatestOnlyWorker(self._render)
+        self._worker.start()
+        
         self._statusbar = StatusBar(self)
         self._statusbar.pack(expand=True, fill=tk.BOTH)
         self._statusbar.set('Starting...')
@@ -169,14 +189,27 @@ class BesselGui(tk.Tk):
             'lens-f': 9999.,
         })
         self.update()
+        self.after(WORKER_POLL_INTERVAL_MS, self.poll_worker)
     
     def connect(self):
+        mock = mock_from_environment()
+        if mock is not None:  # Simulated SLM for running without hardware, see mock_blink.py
+            self.connected = False
+            self.slm_api = mock
+            self.slm_api.Create_SDK()
+            self._statusbar.set('Connected to simulated SLM')
+            self._frame_params.fix_dims(self.slm_api.Read_SLM_dimensions())
+            self.connected = True
+            self.after(1000, self.poll_slm)
+            self.update()
+            return
         api_dir = tk.filedialog.askdirectory(
                 title='Select Meadowlark SDK directory',
                 initialdir=r'C:\Program Files\Meadowlark Optics\Blink OverDrive Plus\SDK'
         )
         if not os.path.exists(api_dir):
             return
+        self.connected = False  # Stop uploads from the worker until the new connection is set up
         os.environ['path'] += ';' + api_dir
         self.path_to_meadowlark_lib = os.path.join(api_dir, 'Blink_C_wrapper.dll')
         self._statusbar.set('Loading {}...'.format(self.path_to_meadowlark_lib))
@@ -205,32 +238,85 @@ class BesselGui(tk.Tk):
         # If dimensions can be retrieved from the SLM, fix the dimension spinboxes
         if self.slm_api.Read_SLM_dimensions()[0] > -1 and self.slm_api.Read_SLM_dimensions()[1] > -1:
             self._frame_params.fix_dims(self.slm_api.Read_SLM_dimensions())
+        self.connected = True
         self.after(1000, self.poll_slm)  # Start polling SLM
         self.update()
         
     def update(self):
+        """
+        Queue the current parameters for the worker. Any request which the worker has not started yet is replaced.
+        """
         try:
-            start = time.time()
-            self._statusbar.set('Generating mask...')
-            mask = generate_mask(self._frame_params.get_parameters())
-            self._statusbar.set('Generated phase mask in {} s.'.format(str(time.time() - start)[0:5]))
-            self._bmp_display.set_image(mask)
-            if self.slm_api.api_loaded:
-                if self.slm_api.Write_image(mask.flatten(order='F')) == 0:
+            parameters = self._frame_params.get_parameters()
+        except (AttributeError, tk.TclError, ValueError):  # Callback not set up yet or a spinbox is being edited
+            return
+        self._statusbar.set('Generating mask...')
+        self._worker.submit(parameters)
+    
+    def _render(self, parameters: dict):
+        """
+        Runs on the worker thread: generate the mask and its preview, or take them from the display cache, and upload
+        the mask to the SLM if one is connected.
+        """
+        start = time.time()
+        key = tuple(sorted(rendered_parameters(parameters).items()))
+        cached = self._display_cache.get(key)
+        if cached is not None:
+            mask, preview = cached
+            if self.connected:
+                self.slm_api.frame(parameters['slm-dimensions'])[...] = mask
+        else:
+            if self.connected:
+                # Render straight into the SLM's upload buffer so that no copies are made before the upload
+                mask = generate_cached_mask(parameters, out=self.slm_api.frame(parameters['slm-dimensions']))
+            else:
+                mask = generate_cached_mask(parameters)
+            preview = encode_preview(mask, self._bmp_display.preview_size)
+            # The upload buffer is overwritten by the next mask, so the cache keeps a copy
+            self._display_cache.put(key, (np.array(mask, order='F'), preview), mask.nbytes + len(preview))
+        elapsed = time.time() - start
+        status = None
+        if self.connected:
+            with self._slm_lock:
+                status = self.slm_api.Write_image()
+        return preview, elapsed, status, cached is not None
+    
+    def poll_worker(self):
+        """
+        Runs on the Tk main loop: display the newest mask finished by the worker.
+        """
+        latest = self._worker.latest_result()
+        if latest is not None:
+            parameters, result = latest
+            if isinstance(result, Exception):
+                self._statusbar.set('Failed to generate phase mask: {}'.format(result))
+            else:
+                preview, elapsed, status, cached = result
+                self._bmp_display.set_preview(preview)
+                self._statusbar.set('{} phase mask in {} s. Cache: {} hits, {} misses'.format(
+                    'Recalled' if cached else 'Generated', str(elapsed)[0:5], self._display_cache.hits,
+                    self._display_cache.misses))
+                if status == 0:
                     print('Phase mask uploaded with Error Code 0')
-        except Exception as e:  # TODO something less stupid
-            print(e)
-            pass # Callback not set up yet
+        self.after(WORKER_POLL_INTERVAL_MS, self.poll_worker)
     
     def poll_slm(self):
         """
         Every second, checks on SLM temperature and therefore on connectivity status.
         """
-        temp = self.slm_api.Read_SLM_temperature()
+        # Don't wait on an upload in progress, which would block the UI. Check again next time instead
+        if not self._slm_lock.acquire(blocking=False):
+            self.after(1000, self.poll_slm)
+            return
+        try:
+            temp = self.slm_api.Read_SLM_temperature()
+        finally:
+            self._slm_lock.release()
         if temp > -1:
             self._label_temp.config(text='SLM Connected ({0:.2f} °C)'.format(temp), fg='blue')
             self.after(1000, self.poll_slm)
         else:
+            self.connected = False
             self._label_temp.config(text='SLM Disconnected', fg='red')
             self._frame_params.unfix_dims()
             self._statusbar.set('Lost connection to SLM')
@@ -483,31 +569,49 @@ class AxiconParamFrame(tk.Frame):
         self.toggle_ramp()
 
 
+def encode_preview(img: np.ndarray, size: tuple = (320, 192)) -> bytes:
+    """
+    Return a binary PGM of `img` area-averaged by the smallest integer factor which fits it in `size`. The x axis
+    (axis 0) of the mask is the width of the image. Edge pixels which do not fill a whole block are cropped.
+    """
+    factor = max(1, -(-img.shape[0] // size[0]), -(-img.shape[1] // size[1]))
+    width, height = img.shape[0] // factor, img.shape[1] // factor
+    dtype = np.uint16 if factor**2 * 255 < 2**16 else np.uint32
+    # Sum the blocks along one axis at a time, which is much faster than a 2-D reduction over a 4-D view
+    preview = img[:width * factor, :height * factor].reshape(width, factor, height * factor).sum(axis=1, dtype=dtype)
+    preview = preview.reshape(width, height, factor).sum(axis=2, dtype=dtype) // factor**2
+    return 'P5 {} {} 255\n'.format(width, height).encode('ascii') + preview.T.astype(np.uint8).tobytes()
+
+
 class BmpDisplay(tk.Frame):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, preview_size=(320, 192), **kwargs):
         tk.Frame.__init__(self, *args, **kwargs)
-        self.width=0
-        self.height=0
+        self.preview_size = preview_size
         self.canvas = tk.Canvas(self)
-        self.image = tk.PhotoImage(width=self.width, height=self.height)
+        self.image = tk.PhotoImage(width=0, height=0)
         self._container = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.image)
         self.canvas.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
         self.canvas.pack()
 
-    def set_image(self, img: np.ndarray, downsample_factor=6):
-        img = img[0::downsample_factor, 0::downsample_factor]
-        self.width = img.shape[0]
-        self.height = img.shape[1]
-        self.image = tk.PhotoImage(width=self.width, height=self.height)
-        img = img.astype(int).flatten(order='F')
-        rgb_colors = ([img[j], img[j], img[j]] for j in range(0, len(img)))
-        pixels=" ".join(("{"+" ".join(('#%02x%02x%02x' %
-            tuple(next(rgb_colors)) for i in range(self.width)))+"}" for j in range(self.height)))
-        self.image.put(pixels, (0, 0, self.width - 1, self.height - 1))
+    @property
+    def width(self):
+        return self.image.width()
+
+    @property
+    def height(self):
+        return self.image.height()
+
+    def set_image(self, img: np.ndarray):
+        self.set_preview(encode_preview(img, self.preview_size))
+
+    def set_preview(self, pgm: bytes):
+        """Display a binary PGM such as returned by encode_preview. Tk parses the pixel data in bulk."""
+        self.image = tk.PhotoImage(data=pgm, format='PPM')
         self.canvas.itemconfig(self._container, image=self.image)
 
 
 if __name__ == '__main__':
+    enable_default_cache()
     root = BesselGui()
     root.mainloop()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 18:20:41 2026
+
+Single-file archive of uint8 phase masks and the parameters which generated
+them. Each mask is stored as one chunk, optionally zlib-compressed, in the
+order of mask.flatten(order='F') so that uncompressed masks can be read as
+zero-copy views of a memory map and uploaded straight to the SLM. The index of
+the chunks and their parameters is written in segments, one per flush, after
+the chunks they list:
+
+    header   b'BSLMARCH' + uint32 version + 4 bytes padding
+             + uint64 offset + uint64 length of the last index segment
+    chunks   mask bytes, one chunk per mask
+    segment  UTF-8 JSON {previous: [offset, length] of the segment before or
+             null, entries: list of {offset, nbytes, shape, compression, params}}
+    ...      more chunks and segments
+
+Nothing is ever written over a chunk or segment, and the header is only
+pointed at a segment once it is on disk, so an archive interrupted while masks
+are appended still opens with the masks of its last flush.
+
+@author: sstucker
+"""
+
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+MAGIC = b'BSLMARCH'
+VERSION = 2
+_HEADER = struct.Struct('<8sI4x')
+_INDEX_POINTER = struct.Struct('<QQ')  # Follows the header
+
+
+def _jsonable(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (tuple, list, np.ndarray)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    return value
+
+
+def _key(params: dict) -> str:
+    return json.dumps(_jsonable(params), sort_keys=True)
+
+
+class MaskArchive():
+    """
+    Archive of masks opened in `mode` 'r' (memory-mapped), 'w' (create or truncate) or 'a' (append). Masks appended
+    in 'w' or 'a' mode are compressed if `compression` is 'zlib'. Use as a context manager or call close() to write
+    the index.
+    """
+
+    def __init__(self, path: str, mode: str = 'r', compression: str = None, level: int = 6):
+        if mode not in ('r', 'w', 'a'):
+            raise ValueError("mode must be 'r', 'w' or 'a', not {}".format(mode))
+        if compression not in (None, 'zlib'):
+            raise ValueError("compression must be None or 'zlib', not {}".format(compression))
+        self.path = path
+        self.mode = mode
+        self.compression = compression
+        self.level = level
+        self._entries = []
+        self._lookup = {}
+        self._map = None
+        self._file = None
+        self._segment = None  # (offset, length) of the last index segment written
+        if mode == 'w' or (mode == 'a' and not os.path.exists(path)):
+            self._file = open(path, 'w+b')
+            self._file.write(_HEADER.pack(MAGIC, VERSION) + _INDEX_POINTER.pack(0, 0))
+            self._end = _HEADER.size + _INDEX_POINTER.size
+            self._flushed = -1  # Write an empty index on the first flush
+        else:
+            self._end = self._read_index()
+            if mode == 'r':
+                self._map = np.memmap(path, dtype=np.uint8, mode='r')
+            else:
+                self._file = open(path, 'r+b')
+            self._flushed = len(self._entries)
+
+    def _read_index(self) -> int:
+        """Read the index and return the end of the data it refers to, after which new data is written."""
+        with open(self.path, 'rb') as file:
+            magic, version = _HEADER.unpack(file.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError('{} is not a mask archive'.format(self.path))
+            if version != VERSION:
+                raise ValueError('{} has unsupported version {}'.format(self.path, version))
+            self._segment = _INDEX_POINTER.unpack(file.read(_INDEX_POINTER.size))
+            if self._segment[0] == 0:
+                raise ValueError('{} has no index. It may not have been closed'.format(self.path))
+            segments = []
+            pointer = self._segment
+            while pointer is not None:
+                file.seek(pointer[0])
+                segment = json.loads(file.read(pointer[1]).decode('utf-8'))
+                segments.append(segment['entries'])
+                pointer = segment['previous']
+        self._entries = [entry for entries in reversed(segments) for entry in entries]
+        self._lookup = {_key(entry['params']): i for i, entry in enumerate(self._entries)}
+        # Anything after the last segment was written by an interrupted append and is not referred to
+        return sum(self._segment)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, i) -> np.ndarray:
+        return self.mask(i)
+
+    def __contains__(self, params) -> bool:
+        return _key(params) in self._lookup
+
+    def append(self, mask: np.ndarray, **params) -> int:
+        """Add a 2D uint8 mask generated with `params`, which must be JSON serializable. Returns its index."""
+        if self._file is None:
+            raise ValueError('Archive is open for reading')
+        if mask.ndim != 2 or mask.dtype != np.uint8:
+            raise ValueError('mask must be a 2D uint8 array, not {} {}'.format(mask.dtype, mask.shape))
+        key = _key(params)
+        if key in self._lookup:
+            raise ValueError('Archive already has a mask with parameters {}'.format(key))
+        data = mask.tobytes(order='F')
+        if self.compression == 'zlib':
+            data = zlib.compress(data, self.level)
+        self._file.seek(self._end)
+        self._file.write(data)
+        self._entries.append({
+            'offset': self._end,
+            'nbytes': len(data),
+            'shape': list(mask.shape),
+            'compression': self.compression,
+            'params': _jsonable(params)
+        })
+        self._end += len(data)
+        self._lookup[key] = len(self._entries) - 1
+        return len(self._entries) - 1
+
+    def flush(self):
+        """
+        Write an index segment of the masks appended since the last flush and then point the header at it, after which
+        the archive opens with these masks even if the process is killed while appending more.
+        """
+        if self._file is None or self._flushed == len(self._entries):
+            return
+        segment = json.dumps({
+            'previous': None if self._segment is None else list(self._segment),
+            'entries': self._entries[max(self._flushed, 0):]
+        }).encode('utf-8')
+        self._file.seek(self._end)
+        self._file.write(segment)
+        self._file.truncate()
+        self._sync()  # The segment and the chunks it lists must be on disk before the header refers to them
+        self._segment = (self._end, len(segment))
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(MAGIC, VERSION) + _INDEX_POINTER.pack(*self._segment))
+        self._sync()
+        self._end += len(segment)
+        self._flushed = len(self._entries)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+        self._map = None
+
+    def _chunk(self, entry: dict):
+        if self._map is not None:
+            return self._map[entry['offset']:entry['offset'] + entry['nbytes']]
+        self._file.seek(entry['offset'])
+        return np.frombuffer(self._file.read(entry['nbytes']), dtype=np.uint8)
+
+    def mask(self, i: int) -> np.ndarray:
+        """
+        Return mask `i` as a Fortran-ordered (width, height) array. In 'r' mode uncompressed masks are read-only
+        views of the memory map, which are only read from disk as they are accessed.
+        """
+        entry = self._entries[i]
+        chunk = self._chunk(entry)
+        if entry['compression'] == 'zlib':
+            chunk = np.frombuffer(zlib.decompress(chunk), dtype=np.uint8)
+        return chunk.reshape(entry['shape'], order='F')
+
+    def params(self, i: int) -> dict:
+        return dict(self._entries[i]['params'])
+
+    def shape(self, i: int) -> tuple:
+        return tuple(self._entries[i]['shape'])
+
+    def find(self, **params) -> int:
+        """Return the index of the mask generated with exactly `params`."""
+        try:
+            return self._lookup[_key(params)]
+        except KeyError:
+            raise KeyError('No mask with parameters {}'.format(_key(params)))
+
+    def get(self, **params) -> np.ndarray:
+        return self.mask(self.find(**params))
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 19:40:55 2026
+
+Persistent cache of generated masks shared between sessions and processes.
+Each mask is stored as a .npy file named by a hash of the canonical JSON of
+the parameters which generated it and is loaded memory-mapped. Files are
+evicted least recently used first, by modification time, which is refreshed
+on every hit, once the cache exceeds its size cap.
+
+There is no default cache unless one is enabled, so that generating masks
+has no side effects on disk. The GUI enables one in ~/.besselgui/mask_cache
+with enable_default_cache(). The BESSELGUI_MASK_CACHE environment variable
+enables one in the directory it names, or in ~/.besselgui/mask_cache if it is
+'1' or 'on', and disables it if it is '0' or 'off', for any program.
+BESSELGUI_MASK_CACHE_MB sets the size cap.
+
+@author: sstucker
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+CACHE_ENV_VAR = 'BESSELGUI_MASK_CACHE'
+CACHE_SIZE_ENV_VAR = 'BESSELGUI_MASK_CACHE_MB'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.besselgui', 'mask_cache')
+DEFAULT_CACHE_MB = 2048
+
+
+def _default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+def parameter_hash(params: dict) -> str:
+    """Return a hash of `params` which is the same for equal values, regardless of key order or tuple vs list."""
+    canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=_default)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class MaskCache():
+    """Cache of masks in `directory`, holding at most about `max_bytes` of them."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_MB * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(size for path, mtime, size in self._files())
+
+    def _path(self, params: dict) -> str:
+        return os.path.join(self.directory, parameter_hash(params) + '.npy')
+
+    def _files(self) -> list:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Evicted by another process
+                    continue
+                files.append((entry.path, stat.st_mtime, stat.st_size))
+        return files
+
+    def get(self, params: dict, mmap_mode: str = 'r') -> np.ndarray:
+        """
+        Return the mask generated with `params`, memory-mapped with `mmap_mode`, or None. Masks are read-only by
+        default. Use mmap_mode='c' for a copy-on-write mask which can be modified without changing the cache.
+        """
+        path = self._path(params)
+        try:
+            mask = np.load(path, mmap_mode=mmap_mode)
+            os.utime(path)  # Mark as recently used
+        except (FileNotFoundError, ValueError, OSError):  # Missing, or being replaced by another process
+            self.misses += 1
+            return None
+        self.hits += 1
+        return mask
+
+    def put(self, params: dict, mask: np.ndarray):
+        """Store `mask` as generated with `params`, evicting the least recently used masks if over the size cap."""
+        path = self._path(params)
+        partial = '{}.{}.part'.format(path, os.getpid())
+        with open(partial, 'wb') as file:
+            np.save(file, mask)  # Keeps the memory order of the mask
+        try:
+            self._bytes -= os.path.getsize(path)  # Replaced rather than added
+        except OSError:
+            pass
+        os.replace(partial, path)  # Readers in other processes never see a partially written file
+        self._bytes += os.path.getsize(path)
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def get_or_create(self, params: dict, generate, mmap_mode: str = 'r') -> np.ndarray:
+        """Return the cached mask for `params`, or the mask returned by generate(), which is cached."""
+        mask = self.get(params, mmap_mode)
+        if mask is None:
+            mask = generate()
+            self.put(params, mask)
+        return mask
+
+    def evict(self, max_bytes: int = None):
+        """Remove the least recently used masks until the cache holds at most `max_bytes`, the size cap by default."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        files = sorted(self._files(), key=lambda file: file[1])
+        self._bytes = sum(size for path, mtime, size in files)
+        for path, mtime, size in files:
+            if self._bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # Already evicted by another process, or mapped by a reader on Windows
+                continue
+            self._bytes -= size
+
+    def clear(self):
+        self.evict(0)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+_default_cache = None
+_enabled_directory = None
+
+
+def enable_default_cache(directory: str = DEFAULT_CACHE_DIR):
+    """Use a cache in `directory` as the default cache, unless the environment configures another or disables it."""
+    global _enabled_directory
+    _enabled_directory = directory
+
+
+def default_cache():
+    """
+    Return the cache configured by the environment or enable_default_cache(), created on first use, or None if no
+    cache is enabled.
+    """
+    global _default_cache
+    directory = os.environ.get(CACHE_ENV_VAR, _enabled_directory)
+    if directory is None or directory.lower() in ('0', 'off', ''):
+        return None
+    if directory.lower() in ('1', 'on'):
+        directory = DEFAULT_CACHE_DIR
+    if _default_cache is None or _default_cache.directory != directory:
+        max_bytes = int(float(os.environ.get(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_MB)) * 2**20)
+        try:
+            _default_cache = MaskCache(directory, max_bytes)
+        except OSError:  # i.e. an unwritable home directory. Work without a cache
+            return None
+    return _default_cache
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 11:02:48 2026
+
+Closed-form phase mask kernels shared by the GUI and bessel.py.
+
+Each kernel writes an 8-bit mask into a caller-provided uint8 buffer `out`
+(or a new one) of shape `dimensions`. The buffer may be a view with any
+memory layout, i.e. the Fortran-ordered frame expected by the SLM. Full-frame
+radius and angle grids are kept in GRID_CACHE, an LRU cache with a memory cap,
+so that changing only a period or focal length does not recompute them.
+Coordinate grids and working arrays are shared between calls, so these
+functions are not thread-safe: call them from one thread at a time.
+
+@author: sstucker
+"""
+
+import collections
+import functools
+import numpy as np
+
+
+@functools.lru_cache(maxsize=8)
+def coordinates(dimensions: tuple) -> (np.ndarray, np.ndarray):
+    """Return the centered x and y pixel coordinates of an SLM with the given dimensions as float32 vectors."""
+    holo_x = dimensions[0] // 2
+    holo_y = dimensions[1] // 2
+    x = np.linspace(-holo_x, holo_x, dimensions[0]).astype(np.float32)
+    y = np.linspace(-holo_y, holo_y, dimensions[1]).astype(np.float32)
+    x.setflags(write=False)
+    y.setflags(write=False)
+    return x, y
+
+
+_scratch_buffers = {}
+
+
+def _scratch(dimensions: tuple, dtype, name: str, order: str = 'C') -> np.ndarray:
+    """Return a persistent working array which is overwritten by the next kernel that asks for the same name."""
+    key = (name, tuple(dimensions), np.dtype(dtype).str, order)
+    if key not in _scratch_buffers:
+        for stale in [k for k in _scratch_buffers if k[0] == name]:
+            del _scratch_buffers[stale]  # Only keep buffers for the current SLM geometry
+        _scratch_buffers[key] = np.empty(dimensions, dtype=dtype, order=order)
+    return _scratch_buffers[key]
+
+
+def memory_order(a: np.ndarray) -> str:
+    """Return 'F' for a Fortran-ordered 2-D array such as the SLM frame, otherwise 'C'."""
+    return 'F' if a.ndim == 2 and a.flags.f_contiguous and not a.flags.c_contiguous else 'C'
+
+
+def _take(table: np.ndarray, index: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    np.take into `out`. np.take iterates in C order, so for a Fortran-ordered `out` (and `index`) the transposed
+    views are used, which is over twice as fast as writing into `out` with strides.
+    """
+    if memory_order(out) == 'F':
+        np.take(table, index.T, out=out.T, mode='clip')
+        return out
+    return np.take(table, index, out=out, mode='clip')
+
+
+def _output(dimensions: tuple, out: np.ndarray) -> np.ndarray:
+    if out is None:
+        return np.empty(dimensions, dtype=np.uint8)
+    if out.shape != tuple(dimensions) or out.dtype != np.uint8:
+        raise ValueError('out must be a uint8 array of shape {}, not {} {}'.format(tuple(dimensions), out.dtype, out.shape))
+    return out
+
+
+def _squared_terms(dimensions: tuple, alpha: tuple, offset: tuple) -> (np.ndarray, np.ndarray):
+    """Return b2_x·(x + offset_x)² and b2_y·(y + offset_y)² as broadcastable column and row vectors."""
+    x, y = coordinates(tuple(dimensions))
+    b2_x = np.float32(np.cos(alpha[0])**2)
+    b2_y = np.float32(np.cos(alpha[1])**2)
+    return (b2_x * (x + np.float32(offset[0]))**2)[:, np.newaxis], (b2_y * (y + np.float32(offset[1]))**2)[np.newaxis, :]
+
+
+class LRUCache():
+    """Mapping which evicts its least recently used entries once their total size exceeds `max_bytes`."""
+    
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # key -> (value, nbytes)
+        self._nbytes = 0
+    
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, key):
+        return key in self._entries
+    
+    def get(self, key, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+    
+    def put(self, key, value, nbytes: int = None):
+        """Insert `value`, whose size defaults to value.nbytes. Values larger than max_bytes are not stored."""
+        if nbytes is None:
+            nbytes = value.nbytes
+        self.pop(key)
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = (value, nbytes)
+        self._nbytes += nbytes
+        self.evict()
+    
+    def pop(self, key, default=None):
+        if key not in self._entries:
+            return default
+        value, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+        return value
+    
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        while self._nbytes > self.max_bytes and self._entries:
+            _, nbytes = self._entries.popitem(last=False)[1]
+            self._nbytes -= nbytes
+    
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+
+class GridCache(LRUCache):
+    """
+    Full-frame coordinate grids keyed by SLM geometry: (dimensions, offset) for the polar angle and (dimensions,
+    offset, alpha) for the elliptical radius. Index grids are also kept in Fortran order if asked for, to match
+    Fortran-ordered outputs. Cached arrays are read-only.
+    """
+    
+    def _lookup(self, key, compute, order='C') -> np.ndarray:
+        key = key + (order,)
+        grid = self.get(key)
+        if grid is None:
+            grid = compute()
+            if order == 'F':
+                grid = np.asfortranarray(grid)
+            grid.setflags(write=False)
+            self.put(key, grid)
+        return grid
+    
+    def radius(self, dimensions: tuple, alpha: tuple = (0., 0.), offset: tuple = (0, 0)) -> np.ndarray:
+        key = ('radius', tuple(dimensions), _key(offset), _key(alpha))
+        def compute():
+            x2, y2 = _squared_terms(dimensions, alpha, offset)
+            return np.sqrt(x2 + y2)
+        return self._lookup(key, compute)
+    
+    def radius_index(self, dimensions: tuple, alpha: tuple = (0., 0.), offset: tuple = (0, 0), order: str = 'C') -> np.ndarray:
+        """Integer part of the elliptical radius."""
+        key = ('radius-index', tuple(dimensions), _key(offset), _key(alpha))
+        def compute():
+            r = self.radius(dimensions, alpha, offset)
+            return r.astype(np.uint16 if r.size == 0 or r.max() < 2**16 else np.uint32)
+        return self._lookup(key, compute, order)
+    
+    def angle(self, dimensions: tuple, offset: tuple = (0, 0)) -> np.ndarray:
+        """Polar angle arctan2(-x, -y) + π in [0, 2π] about the offset center."""
+        key = ('angle', tuple(dimensions), _key(offset))
+        def compute():
+            x, y = coordinates(tuple(dimensions))
+            return np.arctan2(
+                -(x + np.float32(offset[0]))[:, np.newaxis],
+                -(y + np.float32(offset[1]))[np.newaxis, :]
+            ) + np.float32(np.pi)
+        return self._lookup(key, compute)
+    
+    def sector_index(self, dimensions: tuple, sections: int, offset: tuple = (0, 0), layout: tuple = (0, 1), order: str = 'C') -> np.ndarray:
+        """
+        Flat indices into the memory of an (N, *dimensions) stack of masks which select, for every pixel, the mask that
+        the layout assigns to the pixel's angular sector. Each mask of the stack is C- or Fortran-ordered per `order`.
+        """
+        key = ('sector-index', tuple(dimensions), _key(offset), int(sections), tuple(layout))
+        def compute():
+            size = int(np.prod(dimensions))
+            dtype = np.int32 if (max(layout) + 1) * size < 2**31 else np.intp
+            sector = (self.angle(dimensions, offset) * np.float32(sections / (2 * np.pi))).astype(dtype)  # Truncation is floor for θ >= 0
+            sector %= sections
+            index = np.asarray(layout, dtype=dtype)[sector % len(layout)]
+            index *= size
+            index += np.arange(size, dtype=dtype).reshape(dimensions, order=order)
+            return index
+        return self._lookup(key, compute, order)
+
+
+def _key(values: tuple) -> tuple:
+    return tuple(float(v) for v in values)
+
+
+GRID_CACHE = GridCache(max_bytes=128 * 2**20)  # Adjust GRID_CACHE.max_bytes to change the memory cap
+
+
+def radius(dimensions: tuple, alpha: tuple = (0., 0.), offset: tuple = (0, 0)) -> np.ndarray:
+    """Return the elliptical radius sqrt(b2_x·x² + b2_y·y²) in pixels, where b2 = cos(alpha)². The result is cached and read-only."""
+    return GRID_CACHE.radius(dimensions, alpha, offset)
+
+
+def angle(dimensions: tuple, offset: tuple = (0, 0)) -> np.ndarray:
+    """Return the polar angle in [0, 2π] about the (offset) center of the SLM. The result is cached and read-only."""
+    return GRID_CACHE.angle(dimensions, offset)
+
+
+def axicon_mask(dimensions: tuple, period: int, alpha: tuple = (0., 0.), offset: tuple = (0, 0), greylevel: int = 255, out: np.ndarray = None) -> np.ndarray:
+    """Sawtooth period - floor(r) % period scaled so that its maximum value `period` maps to `greylevel`."""
+    out = _output(dimensions, out)
+    x2, y2 = _squared_terms(dimensions, alpha, offset)
+    rings = np.arange(int(np.sqrt(x2.max() + y2.max())) + 2)
+    # The mask only depends on the integer radius, so it is a lookup into a table with one entry per ring
+    lut = ((period - rings % period) * min(greylevel, 255) // period).astype(np.uint8)
+    return _take(lut, GRID_CACHE.radius_index(dimensions, alpha, offset, memory_order(out)), out)
+
+
+def sector_layout(n_masks: int, weights: tuple = None) -> tuple:
+    """
+    Return the repeating sequence of mask indices assigned to consecutive angular sectors. Mask i is repeated
+    weights[i] times, i.e. weights (2, 1) gives (0, 0, 1). By default each mask takes every n_masks-th sector.
+    """
+    if weights is None:
+        weights = (1,) * n_masks
+    if len(weights) != n_masks or any(int(w) != w or w < 0 for w in weights) or sum(weights) == 0:
+        raise ValueError('weights must be {} non-negative integers which are not all 0, not {}'.format(n_masks, weights))
+    return tuple(i for i, w in enumerate(weights) for _ in range(int(w)))
+
+
+def sector_stack(dimensions: tuple, n_masks: int, order: str = 'C') -> np.ndarray:
+    """
+    Return an (n_masks, *dimensions) uint8 working array for masks to be rendered into before compositing. With
+    order 'F' each mask of the stack is Fortran-ordered, to composite into a Fortran-ordered output.
+    """
+    if order == 'F':
+        return _scratch((n_masks,) + tuple(dimensions)[::-1], np.uint8, 'sector-stack').transpose(0, 2, 1)
+    return _scratch((n_masks,) + tuple(dimensions), np.uint8, 'sector-stack')
+
+
+def composite_sectors(masks, sections: int = 128, offset: tuple = (0, 0), weights: tuple = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    Composite N masks into angular sections about the (offset) center of the SLM. Sector k is taken from
+    masks[layout[k % len(layout)]] where layout = sector_layout(N, weights). `masks` is a sequence of uint8 masks or an
+    (N, *dimensions) stack such as sector_stack(), which is used without copying.
+    """
+    stack = masks if isinstance(masks, np.ndarray) and masks.ndim == 3 else None
+    if stack is not None and stack.flags.c_contiguous:
+        flat, order = stack.reshape(-1), 'C'
+    elif stack is not None and stack.transpose(0, 2, 1).flags.c_contiguous:
+        flat, order = stack.transpose(0, 2, 1).reshape(-1), 'F'
+    else:
+        order = 'C' if out is None else memory_order(out)
+        stack = sector_stack(masks[0].shape, len(masks), order)
+        for i, mask in enumerate(masks):
+            stack[i] = mask
+        flat = stack.reshape(-1) if order == 'C' else stack.transpose(0, 2, 1).reshape(-1)
+    dimensions = stack.shape[1:]
+    out = _output(dimensions, out)
+    if np.may_share_memory(out, flat):
+        flat = flat.copy()
+    index = GRID_CACHE.sector_index(dimensions, sections, offset, sector_layout(len(stack), weights), order)
+    return _take(flat, index, out)
+
+
+def _floor_sum_mod255(col: np.ndarray, row: np.ndarray, out: np.ndarray, negate: bool = False) -> np.ndarray:
+    """
+    Write (±floor(col + row)) % 255 into `out` for a column and a row vector of phases already reduced into [0, 255].
+    The sum is done in 16-bit fixed point and the modulo is a table lookup, which is far cheaper than float modulo.
+    """
+    if memory_order(out) == 'F':
+        _floor_sum_mod255(row, col, out.T, negate)
+        return out
+    a = np.rint(col * 2**16).astype(np.uint32)
+    b = np.rint(row * 2**16).astype(np.uint32)
+    total = _scratch(out.shape, np.uint32, 'fixed-point')
+    np.add(a[:, np.newaxis], b[np.newaxis, :], out=total)
+    np.right_shift(total, 16, out=total)
+    k = np.arange(2 * 255 + 1)
+    lut = ((-k if negate else k) % 255).astype(np.uint8)
+    return np.take(lut, total, out=out, mode='clip')
+
+
+def lens_mask(dimensions: tuple, focal_length: float, alpha: tuple = (0., 0.), offset: tuple = (0, 0), out: np.ndarray = None) -> np.ndarray:
+    """Quadratic phase int((b2_x·x² + b2_y·y²) / 2f) % 255. A focal length of 0 produces an empty mask."""
+    out = _output(dimensions, out)
+    if focal_length == 0:
+        out[...] = 0
+        return out
+    x, y = coordinates(tuple(dimensions))
+    scale = 1 / (2 * abs(focal_length))
+    u = (np.cos(alpha[0])**2 * (x + offset[0]).astype(float)**2 * scale) % 255
+    v = (np.cos(alpha[1])**2 * (y + offset[1]).astype(float)**2 * scale) % 255
+    # int() truncates towards zero, so a negative focal length gives -floor(|phase|)
+    return _floor_sum_mod255(u, v, out, negate=focal_length < 0)
+
+
+def ramp_mask(dimensions: tuple, slope_x: float, slope_y: float, out: np.ndarray = None) -> np.ndarray:
+    """Linear phase (x·slope_x + y·slope_y) % 255 with x and y measured from the corner of the SLM."""
+    out = _output(dimensions, out)
+    u = (np.arange(dimensions[0]) * slope_x) % 255
+    v = (np.arange(dimensions[1]) * slope_y) % 255
+    return _floor_sum_mod255(u, v, out)
+
+
+def add_mod(a: np.ndarray, *others: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    Return (a + b + ...) % 255 for uint8 masks without overflowing, written into `out`. Any number of masks are summed
+    into one uint16 buffer and wrapped with a single lookup, which equals adding them modulo 255 one at a time.
+    """
+    out = _output(a.shape, out)
+    if not others:
+        np.copyto(out, a)
+        return out
+    total = _scratch(a.shape, np.uint16, 'sum', memory_order(out))
+    np.add(a, others[0], out=total, dtype=np.uint16)
+    for other in others[1:]:
+        np.add(total, other, out=total)
+    return _take(_MOD255, total, out)
+
+
+_MOD255 = (np.arange(2**16) % 255).astype(np.uint8)  # Covers the sum of up to 257 uint8 masks
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 16:05:12 2026
+
+Simulated Meadowlark SLM for running and timing the GUI, sequence playback and
+calibration code without hardware. MockBlink is a Blink whose SDK library is
+replaced by SimulatedSLMLibrary, so everything above the ctypes calls (buffer
+handling, validation, error handling) is the real code.
+
+Benchmark mask generation and upload throughput:
+
+    python mock_blink.py --frames 200 --latency 0.004
+
+@author: sstucker
+"""
+
+import os
+import sys
+import time
+import ctypes
+import argparse
+from collections import deque
+import numpy as np
+
+from Meadowlark_Blink_C import Blink
+
+MOCK_ENV_VAR = 'BESSELGUI_MOCK_SLM'  # Set to use a simulated SLM, optionally to its dimensions, i.e. '1920x1152'
+
+
+class _SimulatedFunction():
+    """Stands in for a ctypes function pointer, which Blink configures with argtypes and restype."""
+
+    def __init__(self, function):
+        self._function = function
+        self.argtypes = None
+        self.restype = None
+
+    def __call__(self, *args):
+        return self._function(*args)
+
+
+class SimulatedSLMLibrary():
+    """
+    Python implementation of the Blink_C_wrapper functions used by Blink. Each Write_image call takes
+    `write_latency` seconds and fails with status -1 with probability `failure_rate`. While `connected` is False,
+    every call raises OSError as the real library does when the SLM is unplugged. Received frames are copied to
+    `frames` if `record` is True, keeping the most recent `max_recorded`.
+    """
+
+    def __init__(self, dimensions=(1920, 1152), write_latency: float = 0.0, failure_rate: float = 0.0,
+                 record: bool = True, max_recorded: int = None, seed: int = None):
+        self.dimensions = tuple(dimensions)
+        self.write_latency = write_latency
+        self.failure_rate = failure_rate
+        self.record = record
+        self.connected = True
+        self.frames = deque(maxlen=max_recorded)
+        self.write_times = deque(maxlen=max_recorded)  # time.perf_counter() at which each write returned
+        self.writes = 0
+        self.failures = 0
+        self.lut_file = None
+        self._rng = np.random.default_rng(seed)
+        for name in ('Create_SDK', 'Load_LUT_file', 'Write_image', 'Read_SLM_temperature', 'Get_image_width',
+                     'Get_image_height'):
+            setattr(self, name, _SimulatedFunction(getattr(self, '_' + name)))
+
+    def _check_connected(self):
+        if not self.connected:
+            raise OSError('Simulated SLM is disconnected')
+
+    def _Create_SDK(self, bitness, n_boards_found, status, *args):
+        self._check_connected()
+        n_boards_found._obj.value = 1
+        status._obj.value = 0
+        return 0
+
+    def _Load_LUT_file(self, board, path):
+        self._check_connected()
+        if not os.path.exists(path.decode('utf-8')):
+            return -1
+        self.lut_file = path.decode('utf-8')
+        return 0
+
+    def _Write_image(self, board, address, size, wait_for_trigger, external_pulse, timeout_ms):
+        self._check_connected()
+        if self.write_latency > 0:
+            time.sleep(self.write_latency)
+        self.writes += 1
+        if self.failure_rate > 0 and self._rng.random() < self.failure_rate:
+            self.failures += 1
+            return -1
+        if self.record:
+            self.frames.append(np.ctypeslib.as_array((ctypes.c_uint8 * size).from_address(address)).copy())
+        self.write_times.append(time.perf_counter())
+        return 0
+
+    def _Read_SLM_temperature(self, board):
+        self._check_connected()
+        return 25.0 + self._rng.normal(scale=0.05)
+
+    def _Get_image_width(self, board):
+        self._check_connected()
+        return self.dimensions[0]
+
+    def _Get_image_height(self, board):
+        self._check_connected()
+        return self.dimensions[1]
+
+
+class MockBlink(Blink):
+    """Blink backed by a SimulatedSLMLibrary. Keyword arguments other than `validate` configure the library."""
+
+    def __init__(self, path_to_api: str = None, validate: bool = True, **kwargs):
+        self._simulation_options = kwargs
+        super().__init__(path_to_api, validate=validate)
+
+    def _load_library(self, path_to_api: str):
+        return SimulatedSLMLibrary(**self._simulation_options)
+
+    @property
+    def library(self) -> SimulatedSLMLibrary:
+        return self._lib
+
+    def recorded_frame(self, i: int = -1) -> np.ndarray:
+        """Return the i-th recorded upload as a (width, height) mask."""
+        return self._lib.frames[i].reshape(self._lib.dimensions, order='F')
+
+
+def mock_from_environment():
+    """Return a MockBlink if the BESSELGUI_MOCK_SLM environment variable is set, otherwise None."""
+    value = os.environ.get(MOCK_ENV_VAR, '')
+    if value in ('', '0'):
+        return None
+    if 'x' in value:
+        width, height = value.lower().split('x')
+        return MockBlink(dimensions=(int(width), int(height)), record=False)
+    return MockBlink(record=False)
+
+
+def main(argv=None):
+    from main import generate_mask  # The GUI's mask pipeline
+    from sequence import FrameSequence
+
+    parser = argparse.ArgumentParser(description='Benchmark mask generation and upload against a simulated SLM.')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--dims', nargs=2, type=int, default=[1920, 1152], metavar=('X', 'Y'))
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated write latency (s)')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=None, help='Target rate for sequence playback (Hz)')
+    args = parser.parse_args(argv)
+
+    slm = MockBlink(dimensions=args.dims, write_latency=args.latency, failure_rate=args.failure_rate, record=False)
+    slm.Create_SDK()
+    parameters = [{
+        'slm-dimensions': tuple(args.dims),
+        'axicon-1-enabled': True,
+        'period-1': 10 + i % 40,
+        'axicon-2-enabled': i % 2 == 1,
+        'period-2': 50 - i % 40,
+        'mask-offset': (0, 0),
+        'mask-ellipticity': (0.0, 0.0),
+        'mask-contour': (0.0, 0.0),
+        'ramp-enabled': False,
+        'ramp-slope': (0, 0),
+        'lens-enabled': i % 3 == 0,
+        'lens-f': 500.,
+    } for i in range(args.frames)]
+
+    # Live path of the GUI: render into the upload buffer, then upload
+    generate_times, write_times = np.empty(args.frames), np.empty(args.frames)
+    start = time.perf_counter()
+    for i, p in enumerate(parameters):
+        t0 = time.perf_counter()
+        generate_mask(p, out=slm.frame(p['slm-dimensions']))
+        t1 = time.perf_counter()
+        slm.Write_image()
+        write_times[i] = time.perf_counter() - t1
+        generate_times[i] = t1 - t0
+    elapsed = time.perf_counter() - start
+    print('Live: {} frames in {:.2f} s ({:.1f} fps), generate {:.2f} ms, write {:.2f} ms, {} failed'.format(
+        args.frames, elapsed, args.frames / elapsed, np.mean(generate_times) * 1000, np.mean(write_times) * 1000,
+        slm.library.failures))
+
+    # Pre-rendered playback
+    sequence = FrameSequence.render(generate_mask, parameters, args.dims)
+    print('Sequence:', sequence.play(slm, rate=args.rate))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 15:21:47 2026
+
+Playback of pre-rendered frame sequences on the SLM. A FrameSequence is an
+(N, height, width) uint8 stack in which each frame's memory is already in the
+order expected by Blink.Write_image, so frames are uploaded without copies.
+Large stacks can live in a memory-mapped .npy file.
+
+@author: sstucker
+"""
+
+import time
+import numpy as np
+
+
+class PlaybackReport():
+    """Timing of a FrameSequence.play() call. Times are in seconds relative to the start of playback."""
+
+    def __init__(self, target_rate, frame_indices, slots, write_times, statuses, skipped):
+        self.target_rate = target_rate
+        self.frame_indices = np.asarray(frame_indices, dtype=int)  # Index of each frame which was written
+        self.slots = np.asarray(slots, dtype=int)  # Position of each write in the played sequence, counting skipped frames
+        self.write_times = np.asarray(write_times)  # Time at which each write returned
+        self.statuses = np.asarray(statuses)  # Return value of each write. 0 is success
+        self.skipped = skipped  # Frames not written because playback had fallen a whole frame behind
+
+    @property
+    def frames_written(self) -> int:
+        return int(np.sum(self.statuses == 0))
+
+    @property
+    def failed(self) -> int:
+        return int(np.sum(self.statuses != 0))
+
+    @property
+    def dropped(self) -> int:
+        """Frames which were skipped or failed to write."""
+        return self.skipped + self.failed
+
+    @property
+    def late(self) -> int:
+        """Frames written after the end of their slot at the target rate."""
+        if self.target_rate is None:
+            return 0
+        return int(np.sum(self.write_times > (self.slots + 1) / self.target_rate))
+
+    @property
+    def intervals(self) -> np.ndarray:
+        return np.diff(self.write_times)
+
+    @property
+    def achieved_rate(self) -> float:
+        if len(self.write_times) < 2:
+            return float('nan')
+        return (len(self.write_times) - 1) / (self.write_times[-1] - self.write_times[0])
+
+    def __str__(self):
+        intervals = self.intervals * 1000
+        return '{} frames written at {:.2f} Hz (target {}), interval {:.2f} ± {:.2f} ms (max {:.2f} ms), {} late, {} dropped'.format(
+            self.frames_written, self.achieved_rate, 'none' if self.target_rate is None else '{:.2f} Hz'.format(self.target_rate),
+            np.mean(intervals) if intervals.size else float('nan'), np.std(intervals) if intervals.size else float('nan'),
+            np.max(intervals) if intervals.size else float('nan'), self.late, self.dropped
+        )
+
+
+class FrameSequence():
+
+    def __init__(self, frames: np.ndarray):
+        """`frames` is an (N, height, width) C-contiguous uint8 stack, i.e. np.stack([mask.T for mask in masks])."""
+        if frames.ndim != 3 or frames.dtype != np.uint8 or not frames.flags.c_contiguous:
+            raise ValueError('frames must be a C-contiguous (N, height, width) uint8 array')
+        self._frames = frames
+
+    @classmethod
+    def allocate(cls, n_frames: int, dimensions, path: str = None):
+        """Return an empty sequence of (width, height) frames, memory-mapped to a new .npy file at `path` if given."""
+        shape = (n_frames, dimensions[1], dimensions[0])
+        if path is None:
+            return cls(np.zeros(shape, dtype=np.uint8))
+        return cls(np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape))
+
+    @classmethod
+    def render(cls, generate, parameters, dimensions, path: str = None):
+        """
+        Pre-render one frame per item of `parameters` by calling generate(item, out=frame), where `frame` is a
+        Fortran-ordered (width, height) view into the stack, i.e. with the GUI's generate_mask.
+        """
+        parameters = list(parameters)
+        sequence = cls.allocate(len(parameters), dimensions, path)
+        for i, item in enumerate(parameters):
+            generate(item, out=sequence[i])
+        sequence.flush()
+        return sequence
+
+    @classmethod
+    def from_masks(cls, masks, path: str = None):
+        """Copy (width, height) masks into a new sequence."""
+        masks = list(masks)
+        sequence = cls.allocate(len(masks), masks[0].shape, path)
+        for i, mask in enumerate(masks):
+            sequence[i] = mask
+        sequence.flush()
+        return sequence
+
+    @classmethod
+    def from_archive(cls, archive, indices=None, path: str = None):
+        """Copy the masks of a mask_archive.MaskArchive, all of them or those at `indices`, into a new sequence."""
+        indices = range(len(archive)) if indices is None else list(indices)
+        sequence = cls.allocate(len(indices), archive.shape(indices[0]), path)
+        for i, index in enumerate(indices):
+            sequence[i] = archive.mask(index)
+        sequence.flush()
+        return sequence
+
+    @classmethod
+    def open(cls, path: str, mode: str = 'r'):
+        """Memory-map a sequence saved with `path` or save()."""
+        return cls(np.load(path, mmap_mode=mode))
+
+    def save(self, path: str):
+        np.save(path, self._frames)
+
+    def flush(self):
+        if isinstance(self._frames, np.memmap):
+            self._frames.flush()
+
+    @property
+    def dimensions(self) -> tuple:
+        return self._frames.shape[2], self._frames.shape[1]
+
+    def __len__(self):
+        return self._frames.shape[0]
+
+    def __getitem__(self, i) -> np.ndarray:
+        """Return frame i as a Fortran-ordered (width, height) view."""
+        return self._frames[i].T
+
+    def __setitem__(self, i, mask: np.ndarray):
+        self._frames[i] = mask.T
+
+    def play(self, slm, rate: float = None, repeats: int = 1, wait_for_trigger: bool = False, external_pulse: bool = False,
+             timeout_ms: int = 5000, skip_late: bool = False) -> PlaybackReport:
+        """
+        Write each frame to `slm` in order, `repeats` times. If `rate` (Hz) is given, frame k is written no earlier
+        than k / rate after the start. Otherwise frames are written as fast as the SLM accepts them. If `skip_late`,
+        frames whose slot has already passed are skipped to catch up instead of being written late. The trigger
+        arguments are passed on to Blink.Write_image.
+        """
+        period = None if rate is None else 1 / rate
+        frames = self._frames.reshape(len(self), -1)  # Flat views in the order of mask.flatten(order='F')
+        indices, slots, write_times, statuses = [], [], [], []
+        skipped = 0
+        start = time.perf_counter()
+        for k in range(len(self) * repeats):
+            if period is not None:
+                deadline = start + k * period
+                now = time.perf_counter()
+                if skip_late and now > deadline + period:
+                    skipped += 1
+                    continue
+                if deadline - now > 0.002:
+                    time.sleep(deadline - now - 0.002)  # Coarse sleep, then spin for the last couple of ms
+                while time.perf_counter() < deadline:
+                    pass
+            status = slm.Write_image(frames[k % len(self)], wait_for_trigger, external_pulse, timeout_ms)
+            write_times.append(time.perf_counter() - start)
+            indices.append(k % len(self))
+            slots.append(k)
+            statuses.append(status)
+        return PlaybackReport(rate, indices, slots, write_times, statuses, skipped)
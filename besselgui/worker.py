@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 13:40:05 2026
+
+Background worker which keeps slow mask generation and SLM uploads off of the
+Tk main loop. Tk widgets must only be touched from the main thread, so results
+are put on a queue which the GUI polls with `after`.
+
+@author: sstucker
+"""
+
+import queue
+import threading
+
+
+class LatestOnlyWorker(threading.Thread):
+    """
+    Daemon thread which calls `process(request)` for the most recently submitted request only. Requests submitted
+    while another is being processed replace one another, so a burst of parameter changes costs at most one extra
+    call. Each (request, result) pair is put on `results`; if `process` raises, the exception is the result.
+    """
+
+    def __init__(self, process, name='mask-worker'):
+        super().__init__(name=name, daemon=True)
+        self._process = process
+        self._condition = threading.Condition()
+        self._pending = None
+        self._has_pending = False
+        self._stopped = False
+        self.results = queue.Queue()
+        self.dropped = 0  # Number of requests replaced before they were processed
+
+    def submit(self, request):
+        with self._condition:
+            if self._has_pending:
+                self.dropped += 1
+            self._pending = request
+            self._has_pending = True
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def latest_result(self):
+        """Return the newest (request, result) pair posted since the last call, discarding older ones, or None."""
+        latest = None
+        while True:
+            try:
+                latest = self.results.get_nowait()
+            except queue.Empty:
+                return latest
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._has_pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                request = self._pending
+                self._pending = None
+                self._has_pending = False
+            try:
+                result = self._process(request)
+            except Exception as e:
+                result = e
+            self.results.put((request, result))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 19:02:16 2026
+
+Image export of uint8 phase masks. Masks are written as 8-bit single channel
+(mode 'L') BMP, PNG or TIFF images in the orientation of PhaseMask.export,
+optionally as one multipage TIFF per stack of masks. Each image is encoded in
+memory and written with a single call, which is much faster than many small
+writes on a network drive, under a temporary name which is then replaced by
+the final one, so that an interrupted export never leaves a partial image.
+ExportQueue overlaps the encoding and writing of images with the generation
+of the next ones, as in sweep.run_sweep.
+
+@author: sstucker
+"""
+
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+FORMATS = {'.bmp': 'BMP', '.png': 'PNG', '.tif': 'TIFF', '.tiff': 'TIFF'}
+DEFAULT_EXTENSION = '.bmp'
+
+
+def image_filename(filename: str) -> str:
+    """
+    Return `filename` if it has a supported image extension, otherwise `filename` with .bmp appended. Dots elsewhere
+    in the name or path, i.e. 'N030_A0.12', are not taken as an extension.
+    """
+    if os.path.splitext(filename)[1].lower() in FORMATS:
+        return filename
+    return filename + DEFAULT_EXTENSION
+
+
+def to_image(mask: np.ndarray, rgb: bool = False) -> Image.Image:
+    """Return the (width, height) uint8 mask as a PIL image, mode 'L' unless `rgb`."""
+    if mask.dtype != np.uint8:
+        raise ValueError('mask must be uint8, not {}'.format(mask.dtype))
+    image = Image.fromarray(np.ascontiguousarray(np.rot90(mask)), mode='L')
+    return image.convert('RGB') if rgb else image
+
+
+def export_image(mask: np.ndarray, filename: str, rgb: bool = False) -> str:
+    """Write the mask to `filename`, in the format of its extension (BMP if it has none). Returns the path written."""
+    filename = image_filename(filename)
+    image_format = FORMATS[os.path.splitext(filename)[1].lower()]
+    options = {'compress_level': 1} if image_format == 'PNG' else {}  # Fast compression, masks compress well anyway
+    buffer = io.BytesIO()
+    to_image(mask, rgb).save(buffer, format=image_format, **options)
+    root, extension = os.path.splitext(filename)
+    partial = '{}.{}.part{}'.format(root, os.getpid(), extension)
+    with open(partial, 'wb') as file:
+        file.write(buffer.getbuffer())
+    os.replace(partial, filename)  # An interrupted export is not mistaken for a finished one
+    return filename
+
+
+def export_tiff_stack(masks, filename: str, compression: str = None) -> str:
+    """
+    Write an iterable of masks to one multipage TIFF, consuming it as pages are written. `compression` is passed to
+    PIL, i.e. 'tiff_deflate'. Returns the path written.
+    """
+    if os.path.splitext(filename)[1].lower() not in ('.tif', '.tiff'):
+        filename = filename + '.tif'
+    images = (to_image(mask) for mask in masks)
+    first = next(images)
+    options = {} if compression is None else {'compression': compression}
+    first.save(filename, format='TIFF', save_all=True, append_images=images, **options)
+    return filename
+
+
+def read_tiff_stack(filename: str) -> np.ndarray:
+    """Return the pages of a multipage TIFF written by export_tiff_stack as an (N, width, height) array of masks."""
+    with Image.open(filename) as image:
+        pages = []
+        for i in range(image.n_frames):
+            image.seek(i)
+            pages.append(np.rot90(np.asarray(image), -1))
+    return np.stack(pages)
+
+
+class ExportQueue():
+    """
+    Exports masks on a pool of `max_workers` threads. At most `max_pending` exports are queued, after which submit()
+    blocks, so that generating masks faster than they can be written does not exhaust memory. Encoding releases the
+    GIL in PIL and writing waits on the disk, so threads overlap both with the caller's work.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mask-export')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        self.close(wait=True)
+        if exc_type is None:
+            self.result()
+
+    def submit(self, mask: np.ndarray, filename: str, rgb: bool = False):
+        """Queue the export of `mask`, which must not be modified until it is written. Returns a Future."""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(export_image, mask, filename, rgb)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+        return future
+
+    def result(self) -> list:
+        """Wait for all queued exports and return the paths written. Raises the first error of any export."""
+        return [future.result() for future in self._futures]
+
+    def close(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
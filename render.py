@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 20:31:08 2026
+
+Headless batch rendering of field previews. Each worker process generates the
+fields of its jobs and draws them with its own FieldRenderer, which is reused
+for every job, so no pyplot figures are created and no display is needed.
+
+    python render.py R:\\bessel_previews --periods 15 40
+
+@author: sstucker
+"""
+import os
+import sys
+import time
+import argparse
+import functools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from bessel import FieldRenderer, PhaseMask
+
+
+# `make_source` returns the BesselSource to render, i.e. functools.partial(PhaseMask, ...), so that the source, and
+# the mask of a PhaseMask, is only created in the worker process rather than created and pickled by the parent
+RenderJob = namedtuple('RenderJob', ['path', 'make_source', 'wavelength', 'beam_waist', 'length_z', 'radius_r', 'nz', 'nr'])
+
+_renderer = None  # One renderer per worker process
+
+
+def render_job(job: RenderJob) -> RenderJob:
+    global _renderer
+    if _renderer is None:
+        _renderer = FieldRenderer()
+    source = job.make_source()
+    field = source.generate_field(job.wavelength, job.beam_waist, job.length_z, job.radius_r, nz=job.nz, nr=job.nr)
+    _renderer.render(field, source)
+    # Written under another name first, so that a preview interrupted while being saved is not taken as done
+    root, ext = os.path.splitext(job.path)
+    partial = root + '.part' + ext
+    _renderer.save(partial)
+    os.replace(partial, job.path)
+    return job
+
+
+def print_progress(done: int, total: int, job: RenderJob, elapsed: float):
+    print('[{}/{}] {} {:.1f} s elapsed, {:.1f} s remaining'.format(
+        done, total, os.path.basename(job.path), elapsed, elapsed / done * (total - done)))
+
+
+def render_batch(jobs, processes=None, resume=True, progress=print_progress) -> list:
+    """
+    Render each job to a PNG in a pool of `processes` workers (defaults to the number of CPUs). If `resume` is
+    True, jobs whose PNG already exists are skipped. Returns the jobs which were rendered.
+    """
+    if resume:
+        jobs = [job for job in jobs if not os.path.exists(job.path)]
+    for directory in set(os.path.dirname(job.path) for job in jobs):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    start = time.time()
+    completed = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(render_job, job) for job in jobs]
+        for future in as_completed(futures):
+            completed.append(future.result())
+            if progress is not None:
+                progress(len(completed), len(jobs), completed[-1], time.time() - start)
+    return completed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render field previews of a range of PhaseMask periods to PNGs.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--periods', nargs=2, type=int, default=[15, 40], metavar=('START', 'STOP'), help='Pixel periods, STOP excluded')
+    parser.add_argument('--dims', nargs=2, type=int, default=[1920, 1152], metavar=('X', 'Y'), help='SLM dimensions (px)')
+    parser.add_argument('--pixel-size', type=float, default=9.2 * 10**-3, help='mm')
+    parser.add_argument('--phase-stroke', type=float, default=1.4)
+    parser.add_argument('--wavelength', type=float, default=1040 * 10**-6, help='mm')
+    parser.add_argument('--beam-waist', type=float, default=6, help='mm')
+    parser.add_argument('--length', type=float, default=400, help='Simulated length along z (mm)')
+    parser.add_argument('--radius', type=float, default=0.05, help='Simulated radius (mm)')
+    parser.add_argument('--nz', type=int, default=512)
+    parser.add_argument('--nr', type=int, default=128)
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--overwrite', action='store_true', help='Render previews which already exist')
+    args = parser.parse_args(argv)
+    jobs = [
+        RenderJob(
+            os.path.join(args.output_dir, '{}_{}_N{}.png'.format(args.dims[0], args.dims[1], str(period).zfill(3))),
+            functools.partial(PhaseMask, tuple(args.dims), args.pixel_size, args.phase_stroke, int(period)),
+            args.wavelength, args.beam_waist, args.length, args.radius, args.nz, args.nr
+        ) for period in np.arange(*args.periods)
+    ]
+    completed = render_batch(jobs, processes=args.processes, resume=not args.overwrite)
+    print('Rendered {} of {} previews to {}'.format(len(completed), len(jobs), args.output_dir))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 10:12:33 2026
+
+Parallel parameter sweeps over PhaseMask generation and export. Each mask of
+the sweep is generated by a worker process and written by a pool of threads
+while the next masks are generated. Masks which already exist on disk are
+skipped so that an interrupted sweep can be resumed. With
+--archive, the masks are collected into a single MaskArchive file instead,
+and with --stack into a single multipage TIFF.
+
+    python sweep.py R:\\bessel_masks_elliptic --angles 0.003 0.006 24 --incidence 0 24 24
+    python sweep.py R:\\bessel_masks_elliptic --archive masks.bslm
+
+@author: sstucker
+"""
+import os
+import sys
+import time
+import argparse
+import functools
+import itertools
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+import numpy as np
+from scipy.constants import pi as PI
+
+from bessel import Axicon, PhaseMask
+from mask_archive import MaskArchive  # besselgui is put on the path by bessel
+from mask_export import ExportQueue, export_tiff_stack
+
+
+MaskJob = namedtuple('MaskJob', ['path', 'dimensions', 'pixel_size', 'phase_stroke', 'pixel_period', 'alpha'])
+
+
+def mask_filename(dimensions, pixel_period: int, angle_of_incidence: float) -> str:
+    return '{}_{}_N{}_A{}.bmp'.format(dimensions[0], dimensions[1], str(pixel_period).zfill(3), str(angle_of_incidence)[0:4])
+
+
+def axicon_sweep(output_dir: str, axicon_angles, angles_of_incidence, dimensions, wavelength: float, pixel_size: float,
+                 phase_stroke: float, axicon_radius: float, axicon_index: float) -> list:
+    """
+    Return the jobs exporting the PhaseMask equivalent to each axicon angle (rad) at each angle of incidence (deg).
+    Axicon angles which round to the same pixel period produce a single job.
+    """
+    jobs = {}
+    for angle_rad in axicon_angles:
+        period = Axicon(angle_rad, axicon_radius, axicon_index).get_equivalent_period(wavelength, pixel_size, phase_stroke)
+        for angle_of_incidence in angles_of_incidence:
+            path = os.path.join(output_dir, mask_filename(dimensions, period, angle_of_incidence))
+            jobs[path] = MaskJob(path, tuple(dimensions), pixel_size, phase_stroke, period, angle_of_incidence * PI / 180)
+    return list(jobs.values())
+
+
+def job_params(job: MaskJob) -> dict:
+    """The parameters of the job's mask in a MaskArchive, as given by PhaseMask.archive_params."""
+    return {'period': job.pixel_period, 'alpha': job.alpha, 'pixel_size': job.pixel_size, 'phase_stroke': job.phase_stroke}
+
+
+def generate_mask(job: MaskJob) -> (MaskJob, np.ndarray):
+    return job, PhaseMask(job.dimensions, job.pixel_size, job.phase_stroke, job.pixel_period, alpha=job.alpha).mask
+
+
+def generate_masks(executor, jobs, ahead: int):
+    """
+    Yield (job, mask) for each job as its mask is generated by `executor`. At most `ahead` masks are generated ahead
+    of the caller, so that masks are not held in memory faster than the caller can write them.
+    """
+    jobs = iter(jobs)
+    pending = set(executor.submit(generate_mask, job) for job in itertools.islice(jobs, ahead))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+            job = next(jobs, None)
+            if job is not None:
+                pending.add(executor.submit(generate_mask, job))
+
+
+def print_progress(done: int, total: int, job: MaskJob, elapsed: float):
+    eta = elapsed / done * (total - done)
+    print('[{}/{}] {} (period {} px) {:.1f} s elapsed, {:.1f} s remaining'.format(
+        done, total, os.path.basename(job.path), job.pixel_period, elapsed, eta))
+
+
+def run_sweep(jobs, processes=None, resume=True, progress=print_progress, export_threads=4) -> list:
+    """
+    Generate the mask of each job in a process pool of `processes` workers (defaults to the number of CPUs) and write
+    them on an ExportQueue of `export_threads` threads, so that writing to a slow drive overlaps with generation. If
+    `resume` is True, jobs whose output already exists are skipped. `progress` is called with (done, total, job,
+    elapsed_seconds) as each mask is written. Returns the jobs which were run.
+    """
+    if resume:
+        jobs = [job for job in jobs if not os.path.exists(job.path)]
+    for directory in set(os.path.dirname(job.path) for job in jobs):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    start = time.time()
+    completed = []
+    lock = threading.Lock()  # Exports finish on the queue's threads
+
+    def written(job, future):
+        if future.exception() is not None:
+            return  # Raised by the queue on exit
+        with lock:
+            completed.append(job)
+            if progress is not None:
+                progress(len(completed), len(jobs), job, time.time() - start)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        with ExportQueue(max_workers=export_threads, max_pending=2 * export_threads) as queue:
+            for job, mask in generate_masks(executor, jobs, ahead=2 * (processes or os.cpu_count() or 1)):
+                queue.submit(mask, job.path).add_done_callback(functools.partial(written, job))
+    return completed
+
+
+def run_sweep_to_archive(jobs, path: str, processes=None, compression='zlib', progress=print_progress) -> list:
+    """
+    Like run_sweep, but the masks are generated by the workers and appended to the MaskArchive at `path`. Jobs whose
+    parameters are already in the archive are skipped. The archive's index is written after every mask, so an
+    interrupted sweep can be resumed.
+    """
+    start = time.time()
+    completed = []
+    with MaskArchive(path, 'a', compression=compression) as archive:
+        jobs = [job for job in jobs if job_params(job) not in archive]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(generate_mask, job) for job in jobs]
+            for future in as_completed(futures):
+                job, mask = future.result()
+                archive.append(mask, **job_params(job))
+                archive.flush()
+                completed.append(job)
+                if progress is not None:
+                    progress(len(completed), len(jobs), job, time.time() - start)
+    return completed
+
+
+def run_sweep_to_stack(jobs, path: str, processes=None, compression=None) -> str:
+    """
+    Generate the jobs' masks in a process pool and write them, in the order of `jobs`, as pages of one TIFF. The pages
+    of one file are written in order on the calling thread, while the workers generate the next masks.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return export_tiff_stack((mask for job, mask in executor.map(generate_mask, jobs)), path, compression)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate and export a library of axicon PhaseMasks in parallel.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--angles', nargs=3, type=float, default=[0.003, 0.006, 24], metavar=('START', 'STOP', 'N'), help='Axicon angles (rad)')
+    parser.add_argument('--incidence', nargs=3, type=float, default=[0, 24, 24], metavar=('START', 'STOP', 'N'), help='Angles of incidence (deg)')
+    parser.add_argument('--dims', nargs=2, type=int, default=[1920, 1152], metavar=('X', 'Y'), help='SLM dimensions (px)')
+    parser.add_argument('--wavelength', type=float, default=1040 * 10**-6, help='mm')
+    parser.add_argument('--pixel-size', type=float, default=9.2 * 10**-3, help='mm')
+    parser.add_argument('--phase-stroke', type=float, default=1.4)
+    parser.add_argument('--axicon-radius', type=float, default=12.7 / 2, help='mm')
+    parser.add_argument('--axicon-index', type=float, default=1.51637)
+    parser.add_argument('--processes', type=int, default=None, help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('--overwrite', action='store_true', help='Regenerate masks which already exist')
+    parser.add_argument('--archive', default=None, help='Append the masks to this MaskArchive file in output_dir instead of exporting BMPs')
+    parser.add_argument('--no-compression', action='store_true', help='Store archived masks uncompressed for zero-copy reads')
+    parser.add_argument('--stack', default=None, help='Write the masks as pages of this multipage TIFF file in output_dir instead of exporting BMPs')
+    args = parser.parse_args(argv)
+    jobs = axicon_sweep(
+        args.output_dir,
+        np.linspace(args.angles[0], args.angles[1], int(args.angles[2])),
+        np.linspace(args.incidence[0], args.incidence[1], int(args.incidence[2])),
+        args.dims, args.wavelength, args.pixel_size, args.phase_stroke, args.axicon_radius, args.axicon_index
+    )
+    if args.stack is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        path = run_sweep_to_stack(jobs, os.path.join(args.output_dir, args.stack), processes=args.processes)
+        print('Wrote {} masks to {}'.format(len(jobs), path))
+        return
+    if args.archive is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        path = os.path.join(args.output_dir, args.archive)
+        if args.overwrite and os.path.exists(path):
+            os.remove(path)
+        completed = run_sweep_to_archive(jobs, path, processes=args.processes, compression=None if args.no_compression else 'zlib')
+        print('Archived {} of {} masks to {}'.format(len(completed), len(jobs), path))
+        return
+    completed = run_sweep(jobs, processes=args.processes, resume=not args.overwrite)
+    print('Exported {} of {} masks to {}'.format(len(completed), len(jobs), args.output_dir))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
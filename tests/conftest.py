@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The scripts at the root and in besselgui import their neighbours by module name
+for path in (ROOT, os.path.join(ROOT, 'besselgui')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Keep PhaseMasks made by the tests out of the user's mask cache
+os.environ['BESSELGUI_MASK_CACHE'] = 'off'
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 18:45:12 2026
+
+Writes golden_masks.npz, the masks rendered by the original numba implementation of besselgui/main.py, as of the
+first commit of the repository, for tests/test_masks.py and tests/test_main.py.
+
+    python tests/data/make_golden_masks.py
+
+@author: sstucker
+"""
+import os
+import sys
+import json
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+BASELINE = '56917291e67cd8fd900617a47c709e032586c68a'
+sys.path.insert(0, os.path.join(ROOT, 'besselgui'))  # For the original's imports
+
+src = subprocess.run(['git', 'show', BASELINE + ':besselgui/main.py'], cwd=ROOT, stdout=subprocess.PIPE, check=True).stdout.decode('utf-8')
+original = {}
+exec(compile(src[:src.index('class BesselGui')], 'original_main', 'exec'), original)  # Its mask functions only
+
+CASES = [
+    {'slm-dimensions': (96, 64), 'axicon-1-enabled': True, 'period-1': 12, 'axicon-2-enabled': False, 'period-2': 17,
+     'mask-offset': (0, 0), 'mask-ellipticity': (0.0, 0.0), 'ramp-enabled': False, 'ramp-slope': (0, 0),
+     'lens-enabled': False, 'lens-f': 9999.},
+    {'slm-dimensions': (96, 64), 'axicon-1-enabled': True, 'period-1': 12, 'axicon-2-enabled': True, 'period-2': 17,
+     'mask-offset': (3, -2), 'mask-ellipticity': (5.0, -3.0), 'ramp-enabled': True, 'ramp-slope': (1.5, 0.5),
+     'lens-enabled': True, 'lens-f': 500.},
+    {'slm-dimensions': (97, 61), 'axicon-1-enabled': False, 'period-1': 12, 'axicon-2-enabled': True, 'period-2': 9,
+     'mask-offset': (-4, 1), 'mask-ellipticity': (0.0, 10.0), 'ramp-enabled': False, 'ramp-slope': (0, 0),
+     'lens-enabled': True, 'lens-f': 300.},
+]
+
+
+def sectors(x, y, offset, sections):
+    theta = np.arctan2(-(x + offset[0])[:, None], -(y + offset[1])[None, :]) + np.pi
+    return theta / (2 * np.pi / sections)
+
+
+def edges(dimensions, offset, sections):
+    """
+    Pixels which the original assigns to another sector than the axicon kernels' pixel centres do, or which lie within
+    float32 rounding of a sector boundary.
+    """
+    w, h = dimensions
+    original = sectors(np.arange(w) - w // 2, np.arange(h) - h // 2, offset, sections)
+    centred = sectors(np.linspace(-(w // 2), w // 2, w), np.linspace(-(h // 2), h // 2, h), offset, sections)
+    edge = np.floor(original) % sections != np.floor(centred) % sections
+    for s in (original, centred):
+        edge |= np.abs(s - np.round(s)) < 1e-4
+    return edge
+
+
+out = {'cases': np.array(json.dumps(CASES))}
+for i, p in enumerate(CASES):
+    out['mask_{}'.format(i)] = original['generate_mask'](dict(p))
+    out['edges_{}'.format(i)] = edges(p['slm-dimensions'], p['mask-offset'], 64) if p['axicon-2-enabled'] else np.zeros(p['slm-dimensions'], bool)
+# composite_sectors: a constant mask in the even sections of another
+a = np.full((80, 56), 200, dtype=np.uint16)
+b = np.full((80, 56), 7, dtype=np.uint16)
+out['sectors'] = original['add_radial_sections'](a.copy(), b, offset=(2, 5), sections=32).astype(np.uint8)
+out['sectors_edges'] = edges((80, 56), (2, 5), 32)
+np.savez_compressed(os.path.join(ROOT, 'tests', 'data', 'golden_masks.npz'), **out)
+print('Wrote golden masks')
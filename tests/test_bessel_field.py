@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from bessel import Axicon, FieldAccumulator
+
+GRID = (1040e-6, 6, 400, 0.05)
+
+
+@pytest.fixture
+def fields():
+    return [Axicon(angle, 6, 1.5).generate_field(*GRID, nz=32, nr=16) for angle in (0.01, 0.02, 0.03)]
+
+
+@pytest.mark.parametrize('coherent', [True, False])
+def test_accumulator_matches_sum(fields, coherent):
+    accumulator = FieldAccumulator(*GRID, nz=32, nr=16, coherent=coherent)
+    for field in fields:
+        accumulator += field
+    if coherent:
+        assert np.allclose(accumulator.result().field, (fields[0] + fields[1] + fields[2]).field)
+    else:
+        assert np.allclose(accumulator.result().intensity, sum(field.intensity for field in fields))
+
+
+def test_grids_must_match_in_every_parameter(fields):
+    other = Axicon(0.01, 6, 1.5).generate_field(1040e-6, 6, 300, 0.05, nz=32, nr=16)
+    accumulator = FieldAccumulator.like(fields[0])
+    for add in (lambda: fields[0] + other, lambda: accumulator.add(other)):
+        with pytest.raises(ValueError, match='not equivalent'):
+            add()
+    for add in (lambda: fields[0] + 1, lambda: accumulator.add(1)):
+        with pytest.raises(TypeError):
+            add()
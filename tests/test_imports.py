@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import sys
+
+
+def test_besselgui_modules_are_loaded_once():
+    import bessel
+    import sweep
+    import masks
+    import mask_archive
+    import mask_cache
+    assert bessel.masks is masks
+    assert bessel.default_cache is mask_cache.default_cache
+    assert sweep.MaskArchive is mask_archive.MaskArchive
+    assert not any(name.startswith('besselgui.') for name in sys.modules)
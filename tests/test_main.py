@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from masks import memory_order
+from main import MaskCompositor, generate_mask, rendered_parameters
+from test_masks import GOLDEN, CASES, assert_matches_golden
+
+
+def case(i: int, **changes) -> dict:
+    parameters = dict(CASES[i], **changes)
+    parameters['slm-dimensions'] = tuple(parameters['slm-dimensions'])
+    return parameters
+
+
+@pytest.mark.parametrize('order', ['C', 'F'])
+@pytest.mark.parametrize('i', range(len(CASES)))
+def test_generate_mask(i, order):
+    parameters = case(i)
+    out = np.empty(parameters['slm-dimensions'], dtype=np.uint8, order=order)
+    mask = generate_mask(parameters, out)
+    assert mask is out
+    assert memory_order(mask) == order
+    assert_matches_golden(mask, GOLDEN['mask_{}'.format(i)], GOLDEN['edges_{}'.format(i)])
+
+
+@pytest.mark.parametrize('i', range(len(CASES)))
+def test_memory_order_does_not_change_mask(i):
+    parameters = case(i)
+    masks = [MaskCompositor().render(parameters, np.empty(parameters['slm-dimensions'], dtype=np.uint8, order=order))
+             for order in 'CF']
+    assert np.array_equal(*masks)
+
+
+def test_only_changed_layers_are_rendered():
+    compositor = MaskCompositor()
+    first = compositor.render(case(1)).copy()
+    rendered = compositor.rendered
+    assert np.array_equal(compositor.render(case(1, **{'mask-contour': (1.0, 1.0)})), first)
+    assert compositor.rendered == rendered
+    # Only the ramp changes, and the result is that of a fresh compositor
+    changed = compositor.render(case(1, **{'ramp-slope': (0.5, 2.0)}))
+    assert compositor.rendered == rendered + 1
+    assert np.array_equal(changed, MaskCompositor().render(case(1, **{'ramp-slope': (0.5, 2.0)})))
+
+
+def test_rendered_parameters_leave_out_contour():
+    assert 'mask-contour' not in rendered_parameters(case(0, **{'mask-contour': (0.0, 0.0)}))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import subprocess
+import textwrap
+
+import numpy as np
+import pytest
+
+from mask_archive import MaskArchive
+
+BESSELGUI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'besselgui')
+
+
+def masks(n, shape=(40, 30)):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, shape).astype(np.uint8) for _ in range(n)]
+
+
+def write(path, compression=None, n=3):
+    with MaskArchive(str(path), 'w', compression=compression) as archive:
+        for i, mask in enumerate(masks(n)):
+            archive.append(mask, period=i)
+
+
+def run(script: str):
+    """Run `script` in a new Python process, which may be killed part way through."""
+    subprocess.run([sys.executable, '-c', 'import sys; sys.path.insert(0, {!r})\n'.format(BESSELGUI) + textwrap.dedent(script)],
+                   check=False)
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_round_trip(tmp_path, compression):
+    write(tmp_path / 'a.bslm', compression)
+    with MaskArchive(str(tmp_path / 'a.bslm')) as archive:
+        assert len(archive) == 3
+        for i, mask in enumerate(masks(3)):
+            assert np.array_equal(archive.get(period=i), mask)
+
+
+def test_append_across_sessions(tmp_path):
+    write(tmp_path / 'a.bslm')
+    with MaskArchive(str(tmp_path / 'a.bslm'), 'a') as archive:
+        archive.append(masks(4)[3], period=3)
+        archive.flush()
+        archive.append(masks(5)[4], period=4)
+    with MaskArchive(str(tmp_path / 'a.bslm')) as archive:
+        assert [archive.params(i)['period'] for i in range(len(archive))] == [0, 1, 2, 3, 4]
+        for i, mask in enumerate(masks(5)):
+            assert np.array_equal(archive.mask(i), mask)
+
+
+@pytest.mark.parametrize('exit_at', ['append', 'segment'])
+def test_killed_while_appending(tmp_path, exit_at):
+    path = str(tmp_path / 'a.bslm')
+    write(path)
+    # Exit without closing, after the new chunk, or its index segment, is on disk but before the header refers to it
+    run('''
+        import os
+        import numpy as np
+        from mask_archive import MaskArchive
+        archive = MaskArchive({!r}, 'a')
+        archive.append(np.full((40, 30), 7, dtype=np.uint8), period=3)
+        if {!r} == 'segment':
+            archive._sync = lambda: (archive._file.flush(), os._exit(1))
+            archive.flush()
+        archive._file.flush()
+        os._exit(1)
+    '''.format(path, exit_at))
+    with MaskArchive(path) as archive:
+        assert len(archive) == 3
+        for i, mask in enumerate(masks(3)):
+            assert np.array_equal(archive.mask(i), mask)
+    # The archive can still be appended to, over the interrupted append
+    with MaskArchive(path, 'a') as archive:
+        archive.append(masks(4)[3], period=3)
+    with MaskArchive(path) as archive:
+        assert len(archive) == 4
+        assert np.array_equal(archive.get(period=3), masks(4)[3])
+
+
+def test_unclosed_new_archive_has_no_index(tmp_path):
+    path = str(tmp_path / 'a.bslm')
+    run('''
+        import os
+        import numpy as np
+        from mask_archive import MaskArchive
+        archive = MaskArchive({!r}, 'w')
+        archive.append(np.zeros((4, 3), dtype=np.uint8), period=0)
+        archive._file.flush()
+        os._exit(1)
+    '''.format(path))
+    with pytest.raises(ValueError, match='no index'):
+        MaskArchive(path)
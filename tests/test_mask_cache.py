@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+import mask_cache
+from mask_cache import MaskCache, default_cache, enable_default_cache
+
+
+@pytest.fixture
+def no_default(monkeypatch):
+    monkeypatch.delenv(mask_cache.CACHE_ENV_VAR, raising=False)
+    monkeypatch.setattr(mask_cache, '_enabled_directory', None)
+    monkeypatch.setattr(mask_cache, '_default_cache', None)
+
+
+def test_no_cache_unless_enabled(no_default, tmp_path):
+    assert default_cache() is None
+    enable_default_cache(str(tmp_path))
+    assert default_cache().directory == str(tmp_path)
+
+
+def test_environment_overrides_enabled(no_default, monkeypatch, tmp_path):
+    enable_default_cache(str(tmp_path / 'enabled'))
+    monkeypatch.setenv(mask_cache.CACHE_ENV_VAR, 'off')
+    assert default_cache() is None
+    monkeypatch.setenv(mask_cache.CACHE_ENV_VAR, str(tmp_path / 'env'))
+    assert default_cache().directory == str(tmp_path / 'env')
+
+
+def test_phase_mask_caches_only_when_enabled(no_default, monkeypatch, tmp_path):
+    from bessel import PhaseMask
+    created = []
+    monkeypatch.setattr(mask_cache, 'MaskCache', lambda *args: created.append(args) or MaskCache(*args))
+    PhaseMask((64, 48), 9.2e-3, 1.4, 10)
+    assert created == []
+    # Enabling the cache as the GUI does reaches PhaseMask, which then writes its mask there
+    enable_default_cache(str(tmp_path))
+    PhaseMask((64, 48), 9.2e-3, 1.4, 10)
+    assert len(created) == 1
+    assert [path.suffix for path in tmp_path.iterdir()] == ['.npy']
+
+
+def test_get_or_create(tmp_path):
+    cache = MaskCache(str(tmp_path))
+    mask = np.arange(12, dtype=np.uint8).reshape(4, 3)
+    assert np.array_equal(cache.get_or_create({'a': 1}, lambda: mask), mask)
+    assert np.array_equal(cache.get_or_create({'a': 1}, lambda: None), mask)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_put_over_an_entry_does_not_count_it_twice(tmp_path):
+    mask = np.zeros((100, 100), dtype=np.uint8)
+    cache = MaskCache(str(tmp_path), max_bytes=3 * mask.nbytes)
+    cache.put({'a': 1}, mask)
+    cache.put({'b': 1}, mask)
+    for _ in range(3):
+        cache.put({'a': 1}, mask)
+    assert cache.nbytes == sum(path.stat().st_size for path in tmp_path.iterdir())
+    assert cache.get({'b': 1}) is not None  # Not evicted
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from bessel import PhaseMask
+
+SHAPE = (120, 80)
+
+
+def phase_mask(value: int) -> PhaseMask:
+    mask = PhaseMask(SHAPE, 9.2e-3, 1.4, 10)
+    return mask._derived(np.full(SHAPE, value, dtype=np.uint8))
+
+
+def test_half_of_the_pixels_by_default():
+    mixed = phase_mask(1).add_using_uniform_random_sample(phase_mask(2), rng=0)
+    assert isinstance(mixed, PhaseMask)
+    assert (mixed.pixel_size, mixed.phase_stroke, mixed.pixel_period) == (9.2e-3, 1.4, 10)
+    assert np.sum(mixed.mask == 2) == mixed.mask.size // 2
+    assert np.sum(mixed.mask == 1) == mixed.mask.size - mixed.mask.size // 2
+
+
+def test_seeded_samples_repeat():
+    a, b = phase_mask(1), phase_mask(2)
+    assert np.array_equal(a.add_using_uniform_random_sample(b, rng=3).mask, a.add_using_uniform_random_sample(b, rng=3).mask)
+    assert not np.array_equal(a.add_using_uniform_random_sample(b, rng=3).mask, a.add_using_uniform_random_sample(b, rng=4).mask)
+
+
+def test_fractions_of_several_masks():
+    mixed = phase_mask(0).add_using_uniform_random_sample([phase_mask(1), phase_mask(2)], fraction=[0.1, 0.3], rng=0).mask
+    assert np.sum(mixed == 1) == int(0.1 * mixed.size)
+    assert np.sum(mixed == 2) == int(0.3 * mixed.size)
+
+
+def test_several_masks_are_spread_evenly():
+    # numpy's unshuffled samples run from low to high pixel indices, so which mask a pixel came from must not follow
+    # from its position in the sample
+    mixed = phase_mask(0).add_using_uniform_random_sample([phase_mask(1), phase_mask(2)], fraction=0.2, rng=1).mask
+    for value in (1, 2):
+        assert abs(np.mean(np.nonzero(mixed.reshape(-1) == value)[0]) / mixed.size - 0.5) < 0.03
+
+
+@pytest.mark.parametrize('fraction', [-0.1, 1.5, [0.6, 0.6]])
+def test_invalid_fractions(fraction):
+    with pytest.raises(ValueError):
+        phase_mask(0).add_using_uniform_random_sample([phase_mask(1), phase_mask(2)], fraction=fraction)
+
+
+def test_masks_must_have_the_same_shape():
+    other = PhaseMask((60, 40), 9.2e-3, 1.4, 10)
+    with pytest.raises(ValueError):
+        phase_mask(0).add_using_uniform_random_sample(other)
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+import functools
+
+from bessel import PhaseMask
+from render import RenderJob, render_job
+
+
+def test_render_job_replaces_complete_preview(tmp_path):
+    path = str(tmp_path / 'N010.png')
+    job = RenderJob(path, functools.partial(PhaseMask, (64, 48), 9.2e-3, 1.4, 10), 1040e-6, 6, 400, 0.05, 16, 8)
+    render_job(job)
+    assert [p.name for p in tmp_path.iterdir()] == ['N010.png']
+    assert (tmp_path / 'N010.png').read_bytes()[:8] == b'\x89PNG\r\n\x1a\n'
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from bessel import PhaseMask
+from mask_export import ExportQueue, export_image
+from sweep import MaskJob, run_sweep
+
+
+def jobs(directory, periods=(10, 11, 12, 13, 14)):
+    return [MaskJob(os.path.join(str(directory), 'N{:03}_A0.12.bmp'.format(period)), (64, 48), 9.2e-3, 1.4, period, 0.12)
+            for period in periods]
+
+
+def test_run_sweep_matches_export(tmp_path):
+    written = []
+    completed = run_sweep(jobs(tmp_path), processes=2, progress=lambda done, total, job, elapsed: written.append(done),
+                          export_threads=2)
+    assert sorted(job.pixel_period for job in completed) == [10, 11, 12, 13, 14]
+    assert written == [1, 2, 3, 4, 5]
+    assert sorted(os.listdir(str(tmp_path))) == sorted(os.path.basename(job.path) for job in jobs(tmp_path))
+    for job in jobs(tmp_path):
+        expected = PhaseMask(job.dimensions, job.pixel_size, job.phase_stroke, job.pixel_period, alpha=job.alpha)
+        reference = expected.export(str(tmp_path / 'reference.bmp'))
+        assert open(job.path, 'rb').read() == open(reference, 'rb').read()
+    # Nothing is left to do on resume
+    assert run_sweep(jobs(tmp_path), processes=2, progress=None) == []
+
+
+def test_export_queue_bounds_pending_exports(tmp_path, monkeypatch):
+    import mask_export
+    release = threading.Event()
+    started = []
+
+    def slow_export(mask, filename, rgb=False):
+        started.append(filename)
+        release.wait(5)
+        return export_image(mask, filename, rgb)
+
+    monkeypatch.setattr(mask_export, 'export_image', slow_export)
+    mask = np.zeros((8, 6), dtype=np.uint8)
+    queue = ExportQueue(max_workers=1, max_pending=2)
+    queue.submit(mask, str(tmp_path / 'a.png'))
+    queue.submit(mask, str(tmp_path / 'b.png'))
+    blocked = threading.Thread(target=queue.submit, args=(mask, str(tmp_path / 'c.png')))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()  # A third export waits for a free slot
+    release.set()
+    blocked.join(5)
+    queue.close()
+    assert [os.path.basename(path) for path in queue.result()] == ['a.png', 'b.png', 'c.png']
+    assert np.array_equal(np.asarray(Image.open(str(tmp_path / 'c.png'))), np.rot90(mask))
+
+
+def test_export_queue_raises_export_errors(tmp_path):
+    with pytest.raises(ValueError):
+        with ExportQueue() as queue:
+            queue.submit(np.zeros((8, 6), dtype=np.float32), str(tmp_path / 'a.png'))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from bmp_phase_mask_to_zemax_dat import dat_filename, write_dat
+
+
+@pytest.fixture
+def gray():
+    return np.random.default_rng(0).integers(0, 256, (37, 23)).astype(np.uint8)
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.float64])
+def test_non_uint8_matches_uint8(tmp_path, gray, dtype):
+    write_dat(gray, str(tmp_path / 'uint8.dat'))
+    write_dat(gray.astype(dtype), str(tmp_path / 'other.dat'))
+    assert (tmp_path / 'uint8.dat').read_bytes() == (tmp_path / 'other.dat').read_bytes()
+
+
+def test_dat_line_count(tmp_path, gray):
+    write_dat(gray.astype(np.float32) / 2, str(tmp_path / 'half.dat'))
+    assert len((tmp_path / 'half.dat').read_bytes().splitlines()) == gray.size + 1
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('mask', 'mask.dat'),
+    ('mask.dat', 'mask.dat'),
+    ('mask.BMP', 'mask.dat'),
+    ('N030_A0.12', 'N030_A0.12.dat'),
+    ('N030_A0.12.bmp', 'N030_A0.12.dat'),
+])
+def test_dat_filename(filename, expected):
+    assert dat_filename(filename) == expected
+
+
+def test_export_dat_keeps_dotted_names(tmp_path):
+    from bessel import PhaseMask
+    paths = [PhaseMask((64, 48), 9.2e-3, 1.4, 10, alpha=alpha).export_dat(str(tmp_path / 'N010_A{}'.format(alpha)))
+             for alpha in (0.12, 0.15)]
+    assert len(set(paths)) == 2
+    assert all((tmp_path / path).exists() for path in paths)